@@ -33,6 +33,8 @@ constexpr uint32_t PIN_PROGRAM = 12;
 constexpr uint32_t DELAY_US = 50;
 constexpr uint32_t DELAY_LONG_MS = 1000;
 
+constexpr uint8_t BLOCK_SIZE = 64;
+
 ////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////
 
 void clear_bus() {
@@ -103,6 +105,48 @@ void write_mem(uint16_t address, uint8_t value) {
 
 ////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////
 
+uint8_t write_mem_block() {
+    static uint8_t block[BLOCK_SIZE];
+
+    uint16_t address{ 0 };
+    uint8_t length{ 0 };
+    uint8_t checksum{ 0 };
+    uint8_t value{ 0 };
+
+    Serial.readBytes(reinterpret_cast<char *>(&address), sizeof(address));
+    Serial.readBytes(reinterpret_cast<char *>(&length), sizeof(length));
+
+    uint8_t sum = (address & 0xff) + (address >> 8) + length;
+
+    for (uint8_t i = 0; i < length; ++i) {
+        Serial.readBytes(reinterpret_cast<char *>(&value), sizeof(value));
+        if (i < BLOCK_SIZE) {
+            block[i] = value;
+        }
+        sum += value;
+    }
+
+    Serial.readBytes(reinterpret_cast<char *>(&checksum), sizeof(checksum));
+
+    //
+    // Only commit the block to SRAM if it arrived intact. The reply is the checksum when the block was committed, and
+    // otherwise differs from both the received checksum and the sum, as either may be the host's: a block dropped
+    // over a corrupted checksum byte still sums to it. The host resends on anything but its own checksum.
+    //
+
+    if ((length <= BLOCK_SIZE) && (sum == checksum)) {
+        for (uint8_t i = 0; i < length; ++i) {
+            write_mem(address + i, block[i]);
+        }
+        return checksum;
+    }
+
+    uint8_t reply = ~checksum;
+    return (reply == sum) ? (reply ^ 1) : reply;
+}
+
+////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////
+
 void disable() {
     pinMode(PIN_MADDRIN, INPUT);
     pinMode(PIN_MIN, INPUT);
@@ -206,6 +250,10 @@ void loop() {
                 write_mem(address, value);
                 Serial.write(address & 0xff);
                 break;
+
+            case 0x5:
+                Serial.write(write_mem_block());
+                break;
         }
     }
 }
@@ -0,0 +1 @@
+from assembler.assembler import *
\ No newline at end of file
@@ -1,268 +1,1081 @@
 import argparse
+import hashlib
+import json
 import os
 import re
 import subprocess
 import tempfile
+import time
 
-import at28c256
 import bootstrap
+import cpuemu
+from cpuemu.profiler import profile
+from eeproms import control
 
 
-class Label:
-    def __init__(self, label):
+MEMORY_SIZE = 0x8000
+
+# Code stops short of the end of each 256-byte segment, leaving room for the 'LD <next> RSG' that carries execution
+# into the next segment as the PC wraps.
+SEGMENT_SIZE = 0x100
+SEGMENT_LIMIT = 0xfe
+
+REGISTERS = ('A', 'B', 'C', 'DL', 'DH', 'D', 'SG')
+
+
+REGISTER_OFFSETS = {'A': 0, 'B': 1, 'C': 2, 'DL': 3, 'DH': 4, 'D': 5, 'SEG': 6}
+
+# register name -> (name, offset, operand kind)
+REGISTER_SPECS = {reg: (reg, offset, 'R' + REGISTERS[offset]) for reg, offset in REGISTER_OFFSETS.items()}
+
+
+class Token:
+    # Source position of a token, 1-based, when it came from the tokenizer
+    __slots__ = ('line', 'col')
+
+
+class Mnemonic(str):
+    # Instruction name, still usable as a plain str, with the source position of the tokenizer's other tokens
+    def __new__(cls, text, line=0, col=0):
+        m = super().__new__(cls, text)
+        m.line = line
+        m.col = col
+        return m
+
+
+class Label(Token):
+    __slots__ = ('label',)
+
+    def __init__(self, label, line=0, col=0):
         self.label = label
+        self.line = line
+        self.col = col
 
     def __str__(self):
         return f'Label[{self.label}]'
 
 
-class LabelRef:
-    def __init__(self, label):
+class LabelRef(Token):
+    __slots__ = ('label',)
+    kind = 'ref'
+
+    def __init__(self, label, line=0, col=0):
         self.label = label
+        self.line = line
+        self.col = col
 
     def __str__(self):
         return f'LabelRef[{self.label}]'
 
 
-class Memory:
-    def __init__(self, ref):
+class Memory(Token):
+    __slots__ = ('ref', 'kind')
+
+    def __init__(self, ref, line=0, col=0):
         self.ref = ref
+        self.kind = 'mem' if type(ref) == Value else '*' + ref.kind
+        self.line = line
+        self.col = col
 
     def __str__(self):
         return f'Memory[{self.ref}]'
 
 
-class Register:
-    def __init__(self, reg):
-        reg = reg.upper()
-        if not reg in ['A', 'B', 'C', 'DL', 'DH', 'D', 'SEG']:
-            raise Exception(f'Invalid Register Specified {reg}')
-        self.reg = reg
-        self.reg_offset = {'A': 0, 'B': 1, 'C': 2, 'DL': 3, 'DH': 4, 'D': 5, 'SEG': 6}[reg]
+class Register(Token):
+    __slots__ = ('reg', 'reg_offset', 'kind')
+
+    def __init__(self, reg, line=0, col=0):
+        spec = REGISTER_SPECS.get(reg) or REGISTER_SPECS.get(reg.upper())
+        if spec is None:
+            raise Exception(f'Invalid Register Specified {reg.upper()}')
+        self.reg, self.reg_offset, self.kind = spec
+        self.line = line
+        self.col = col
 
     def __str__(self):
         return f'Register[{self.reg}]'
 
 
-class Value:
-    def __init__(self, val):
+class Value(Token):
+    __slots__ = ('val',)
+    kind = 'imm'
+
+    def __init__(self, val, line=0, col=0):
         self.val = val
+        self.line = line
+        self.col = col
 
     def __str__(self):
         return f'Value[{self.val}]'
 
 
-def assemble(tokens):
-    for i in range(0, len(tokens)):
-        mneumonic, params = tokens[i][0], tokens[i][1:]
+class ObjectCode:
+    def __init__(self, size=MEMORY_SIZE):
+        self.code = bytearray(size)
+        self.size = 0
+        self.lines = []
+        self.labels = {}
+        self.fixups = []
+        self.refs = []
+
+    def machine_lines(self):
+        return [list(self.code[offset:offset + length]) for offset, length in self.lines]
+
+
+def _position(tokens):
+    # ' At Line N:C' for the first token carrying a source position, '' if none do
+    for t in tokens:
+        if getattr(t, 'line', 0):
+            return f' At Line {t.line}:{t.col}'
+    return ''
+
+
+def _encoder(opcode, operand=None, kind=None):
+    # Encoders write an instruction straight into the object code buffer. Labels already defined within segment 0 are
+    # resolved on the spot, leaving forward references, and those past it for link_segments(), as fix-ups.
+    if operand is None:
+        def encode(obj, params):
+            obj.code[obj.size] = opcode
+            obj.size += 1
+    elif kind == 'imm':
+        def encode(obj, params):
+            obj.code[obj.size] = opcode
+            obj.code[obj.size + 1] = params[operand].val
+            obj.size += 2
+    elif kind == 'mem':
+        def encode(obj, params):
+            obj.code[obj.size] = opcode
+            obj.code[obj.size + 1] = params[operand].ref.val
+            obj.size += 2
+    else:
+        def encode(obj, params):
+            obj.code[obj.size] = opcode
+            obj.refs.append((obj.size + 1, params[operand].label))
+            address = obj.labels.get(params[operand].label)
+            if address is None or address > 0xff:
+                obj.fixups.append((obj.size + 1, params[operand]))
+            else:
+                obj.code[obj.size + 1] = address
+            obj.size += 2
+    return encode
+
+
+def encoders(instructions):
+    # (mneumonic, operand kinds) -> encoder, generated from the microcode instruction names and opcodes
+    regs = '|'.join(REGISTERS)
+    table = {}
+    for instr, (opcode, _) in instructions.items():
+        if instr in ['NOP', 'ADD', 'SUB', 'OUT']:
+            table[(instr, ())] = _encoder(opcode)
+        elif instr == 'HALT':
+            table[('HLT', ())] = table[('HALT', ())] = _encoder(opcode)
+        elif m := re.match(f'^LD({regs})(M|I)$', instr):
+            dst = 'R' + m.group(1)
+            if m.group(2) == 'M':
+                table[('LD', ('mem', dst))] = _encoder(opcode, 0, 'mem')
+            else:
+                table[('LD', ('imm', dst))] = _encoder(opcode, 0, 'imm')
+                table[('LD', ('ref', dst))] = _encoder(opcode, 0, 'ref')
+        elif m := re.match(f'^ST({regs})(M|C|D)$', instr):
+            src = 'R' + m.group(1)
+            if m.group(2) == 'M':
+                table[('ST', (src, 'mem'))] = _encoder(opcode, 1, 'mem')
+            else:
+                table[('ST', (src, '*R' + m.group(2)))] = _encoder(opcode)
+        elif m := re.match(f'^MV({regs})({regs})$', instr):
+            table[('MV', ('R' + m.group(1), 'R' + m.group(2)))] = _encoder(opcode)
+        elif instr == 'JMPM':
+            for kind in ['imm', 'mem', 'ref']:
+                table[('JMP', (kind,))] = _encoder(opcode, 0, kind)
+        elif m := re.match(f'^JMP({regs})$', instr):
+            table[('JMP', ('R' + m.group(1),))] = _encoder(opcode)
+        elif instr in ['JC', 'JZ']:
+            for kind in ['imm', 'mem', 'ref']:
+                table[(instr, (kind,))] = _encoder(opcode, 0, kind)
+    return table
+
+
+ENCODERS = encoders(control.INSTRUCTIONS)
+
+
+def assemble(tokens, obj=None):
+    if obj is None:
+        obj = ObjectCode()
+
+    for l_tokens in tokens:
+        mneumonic, params = l_tokens[0], l_tokens[1:]
 
         if type(mneumonic) == Label:
+            if mneumonic.label in obj.labels:
+                raise Exception(f'Duplicate Label{_position([mneumonic])} {mneumonic.label}')
+            obj.labels[mneumonic.label] = obj.size
             continue
-        elif type(mneumonic) != str:
+        elif not isinstance(mneumonic, str):
             raise Exception(f'Unknown Mneumonic {mneumonic}')
-            
-        mneumonic = mneumonic.upper()
-
-        translation = []
-
-        if mneumonic == 'HLT':
-            translation.append(0x01)
-        elif mneumonic == 'NOP':
-            translation.append(0x00)
-        elif mneumonic == 'OUT':
-            translation.append(0x43)
-
-        elif mneumonic == 'LD':
-            if len(params) != 2:
-                raise Exception(f'Syntax: LD SRC DST')
-            src, dst = params
-
-            if type(dst) != Register:
-                raise Exception(f'LD DST Register Expected {dst}')
-
-            if type(src) == Value:
-                translation.append(0x09 + dst.reg_offset)
-                translation.append(src.val)
-            elif type(src) == Memory:
-                src = src.ref
-                if type(src) != Value:
-                    raise Exception(f'LD SRC Memory Requires Fixed Address {src}')
-                translation.append(0x02 + dst.reg_offset)
-                translation.append(src.val)
-        elif mneumonic == 'MV':
-            if len(params) != 2:
-                raise Exception(f'Syntax: MV SRC DST')
-            src, dst = params
-
-            if type(src) != Register:
-                raise Exception(f'MV SRC Register Expected')
-            elif type(dst) != Register:
-                raise Exception(f'MV DST Register Expected')
-
-            translation.append(0x25 + 7 * src.reg_offset + dst.reg_offset)
-
-        elif mneumonic == 'ST':
-            if len(params) != 2:
-                raise Exception(f'Syntax: ST SRC DST')
-            src, dst = params
-
-            if type(src) != Register:
-                raise Exception(f'ST SRC Register Expected')
-            elif type(dst) is not Memory:
-                raise Exception(f'ST DST Memory Expected')
-
-            dst = dst.ref
-            if type(dst) not in [Register, Value]:
-                raise Exception(f'ST DST Memory *Register/*Value')
-
-            if type(dst) == Value:
-                translation.append(0x10 + src.reg_offset)
-                translation.append(dst.val)
+
+        kinds = tuple([getattr(p, 'kind', None) for p in params])
+        encode = ENCODERS.get((mneumonic.upper(), kinds))
+        if encode is None:
+            raise Exception(f'Invalid Instruction{_position([mneumonic] + params)} {mneumonic} {" ".join([str(p) for p in params])}')
+        if obj.size + 2 > len(obj.code):
+            raise Exception(f'Program Too Large')
+
+        offset = obj.size
+        try:
+            encode(obj, params)
+        except ValueError:
+            # Operands are a single byte, which the object code buffer enforces, so the encoders need no check
+            bad = [p for p in params if not 0 <= getattr(getattr(p, 'ref', p), 'val', 0) <= 0xff]
+            raise Exception(f'Operand Out Of Range{_position(bad)} {" ".join([str(p) for p in bad])}') from None
+        obj.lines.append((offset, obj.size - offset))
+
+    return obj
+
+
+OPCODES = {instr: opcode for instr, (opcode, _) in control.INSTRUCTIONS.items()}
+
+# Jump forms, chosen per jump by relax(). A JMP can reach segment 0 directly, the rest of its own segment through
+# RDL, and anywhere through RD (both clobber RD, so programs reading RD can't use them). JC / JZ can only land in
+# segment 0, so further targets go by way of a trampoline there holding the far form.
+SHORT, NEAR, FAR = 0, 1, 2
+JMP_SIZES = (2, 3, 5)
+
+
+def _far(address):
+    return [OPCODES['LDDHI'], address >> 8, OPCODES['LDDLI'], address & 0xff, OPCODES['JMPD']]
+
+
+# Instructions that read RD (including RDL or RDH), which the near and far jump forms overwrite
+READS_D = frozenset([opcode for table in (control.INSTRUCTIONS, control.INSTRUCTIONS_CF, control.INSTRUCTIONS_ZF)
+                     for opcode, steps in table.values() if any([control.DOUT in step for step in steps])])
+
+# LD / ST with a direct memory operand, which always addresses segment 0
+DATA_OPCODES = frozenset([opcode for instr, (opcode, _) in control.INSTRUCTIONS.items()
+                          if re.match('^(LD|ST)[A-Z]+M$', instr)])
+
+
+def data_range(obj):
+    # Lowest (no more than SEGMENT_LIMIT) and highest addresses the program reads or writes directly. The linker keeps
+    # segment 0's code and trampolines below the lowest, leaving the bytes from there up as the program's data.
+    data = [obj.code[offset + 1] for offset, length in obj.lines if length == 2 and obj.code[offset] in DATA_OPCODES]
+    return min(data + [SEGMENT_LIMIT]), max(data + [0])
+
+
+def relax(obj):
+    # Lays the program out across segments, starting every jump short and growing the ones that cannot reach their
+    # target until the layout stops moving. Returns the address of each line (plus the end), the jump forms, the
+    # trampoline targets and where in segment 0 the 'JMP <carry>' ahead of the trampolines goes (None without it).
+    lines = obj.lines
+    n = len(lines)
+    starts = {offset: i for i, (offset, _) in enumerate(lines)}
+    starts[obj.size] = n
+    targets = {starts[offset - 1]: label for offset, label in obj.refs}
+    label_lines = {label: starts[offset] for label, offset in obj.labels.items()}
+    jumps = {i: obj.code[lines[i][0]] for i in targets if obj.code[lines[i][0]] in
+             (OPCODES['JMPM'], OPCODES['JC'], OPCODES['JZ'])}
+    forms = dict.fromkeys(jumps, SHORT)
+    floor, highest = data_range(obj)
+
+    while True:
+        trampolines = sorted(set([targets[i] for i, form in forms.items() if form == FAR and
+                                  jumps[i] != OPCODES['JMPM']]))
+        # Segment 0 code jumps over the trampolines, and any data, to the carry
+        reserve = 2 + len(trampolines) * JMP_SIZES[FAR] if trampolines or floor < SEGMENT_LIMIT else 0
+
+        addresses = [0] * (n + 1)
+        address = 0
+        for i in range(0, n):
+            size = JMP_SIZES[forms[i]] if jumps.get(i) == OPCODES['JMPM'] else lines[i][1]
+            limit = floor - reserve if address < SEGMENT_SIZE else SEGMENT_LIMIT
+            if (address & 0xff) + size > limit:
+                address = (address | 0xff) + 1
+            addresses[i] = address
+            address += size
+        addresses[n] = address
+        if address > MEMORY_SIZE:
+            raise Exception(f'Program Too Large')
+        if n and addresses[0]:
+            raise Exception(f'No Room For Code Below Memory Operand {floor:02x}')
+        if address > SEGMENT_SIZE and highest >= SEGMENT_LIMIT:
+            raise Exception(f'Memory Operand Overlaps Segment Carry {highest:02x}')
+
+        changed = False
+        for i in jumps:
+            t = addresses[label_lines[targets[i]]]
+            if t < SEGMENT_SIZE:
+                form = SHORT
+            elif jumps[i] == OPCODES['JMPM'] and t >> 8 == addresses[i] >> 8:
+                form = NEAR
             else:
-                if dst.reg not in ['C', 'D']:
-                    raise Exception(f'ST DST Register Must Be C or D')
-                if dst.reg == 'C':
-                    translation.append(0x17 + src.reg_offset)
-                else:
-                    translation.append(0x1e + src.reg_offset)
-
-        elif mneumonic == 'ADD':
-            translation.append(0x41)
-        elif mneumonic == 'SUB':
-            translation.append(0x42)
-
-        elif mneumonic == 'JMP':
-            if len(params) != 1:
-                raise Exception(f'Syntax: JMP TARGET')
-            target = params[0]
-            if type(target) not in [LabelRef, Memory, Register]:
-                raise Exception('JMP TARGET Memory/Label/Register Expected')
-
-            if type(target) == Register:
-                translation.append(0x45 + target.reg_offset)
+                form = FAR
+            if form > forms[i]:
+                forms[i] = form
+                changed = True
+        if not changed:
+            break
+
+    # The linker inserts these jumps where the program doesn't expect RD to change, so refuse rather than let the
+    # program's layout alter what it does
+    clobbers = [i for i, form in sorted(forms.items()) if form != SHORT]
+    readers = [i for i, (offset, length) in enumerate(lines) if length and obj.code[offset] in READS_D]
+    if clobbers and readers:
+        raise Exception(f'Jump To {targets[clobbers[0]]} Needs RD, Which The Program Reads '
+                        f'({NAMES[obj.code[lines[readers[0]][0]]]} At {addresses[readers[0]]:04x})')
+    return addresses, forms, trampolines, floor - reserve if reserve else None
+
+
+def link_segments(obj):
+    addresses, forms, trampolines, carry_jump = relax(obj)
+    n = len(obj.lines)
+    starts = {offset: i for i, (offset, _) in enumerate(obj.lines)}
+    starts[obj.size] = n
+    labels = {label: addresses[starts[offset]] for label, offset in obj.labels.items()}
+    targets = {offset - 1: label for offset, label in obj.refs}
+
+    code = bytearray(MEMORY_SIZE)
+    end = addresses[n]
+    for s in range(0, (end - 1) >> 8):
+        code[s << 8 | SEGMENT_LIMIT:(s + 1) << 8] = bytes([OPCODES['LDSGI'], s + 1])
+
+    tramps = {}
+    if carry_jump is not None:
+        code[carry_jump:carry_jump + 2] = bytes([OPCODES['JMPM'], SEGMENT_LIMIT])
+        for j, label in enumerate(trampolines):
+            tramps[label] = carry_jump + 2 + j * JMP_SIZES[FAR]
+            code[tramps[label]:tramps[label] + JMP_SIZES[FAR]] = bytes(_far(labels[label]))
+
+    lines = []
+    for i, (offset, length) in enumerate(obj.lines):
+        b = list(obj.code[offset:offset + length])
+        if length and offset in targets:
+            t = labels[targets[offset]]
+            if i in forms and b[0] == OPCODES['JMPM']:
+                b = [b[0], t] if forms[i] == SHORT else \
+                    [OPCODES['LDDLI'], t & 0xff, OPCODES['JMPDL']] if forms[i] == NEAR else _far(t)
+            elif i in forms and forms[i] == FAR:
+                b = [b[0], tramps[targets[offset]]]
+            elif t > 0xff:
+                raise Exception(f'Label Out Of Range {targets[offset]} {t:04x}')
             else:
-                translation.append(0x44)
-                if type(target) == Memory:
-                    translation.append(target.addr)
-                else:
-                    translation.append(target)
-
-        elif mneumonic in ['JC', 'JZ']:
-            if len(params) != 1:
-                raise Exception(f'Syntax: JC/JZ TARGET')
-            target = params[0]
-            if type(target) not in [LabelRef, Memory]:
-                raise Exception('JMP TARGET Memory/Label Expected')
-            translation.append({'JC': 0x4c, 'JZ': 0x4d}[mneumonic])
-            if type(target) == Memory:
-                translation.append(target.addr)
+                b = [b[0], t]
+        code[addresses[i]:addresses[i] + len(b)] = bytes(b)
+        lines.append((addresses[i], len(b)))
+
+    obj.code = code
+    obj.size = end
+    obj.lines = lines
+    obj.labels = labels
+    obj.fixups = []
+    obj.refs = []
+    return bytes(code[:end])
+
+
+def link(obj):
+    for offset, ref in obj.fixups:
+        if not ref.label in obj.labels:
+            raise Exception(f'Unmatched Label Reference {ref.label}')
+    if obj.size > SEGMENT_SIZE or any([obj.labels[label] > 0xff for _, label in obj.refs]):
+        return link_segments(obj)
+    for offset, ref in obj.fixups:
+        obj.code[offset] = obj.labels[ref.label]
+    obj.fixups = []
+    return bytes(obj.code[:obj.size])
+
+
+NAMES = {opcode: instr for instr, (opcode, _) in control.INSTRUCTIONS.items()}
+
+# Instructions whose microcode is the bare fetch, such as MVAA
+NOP_MOVES = frozenset([opcode for instr, (opcode, steps) in control.INSTRUCTIONS.items()
+                       if instr != 'NOP' and steps == control.INSTRUCTIONS['NOP'][1]])
+
+REGISTER_JUMPS = frozenset([OPCODES[instr] for instr in ['JMPA', 'JMPB', 'JMPC', 'JMPDL', 'JMPD']])
+
+# Registers tracked by the peephole pass; C loads whole bytes, D is left alone
+TRACKED = ('A', 'B', 'C')
+
+
+def microsteps(tables):
+    # opcode -> steps up to and including its last non-empty one, the longest over the flag variants
+    counts = {}
+    for table in tables:
+        for opcode, steps in table.values():
+            counts[opcode] = max(counts.get(opcode, 0), max([i + 1 for i, step in enumerate(steps) if step] + [0]))
+    return counts
+
+
+def register_writes(tables):
+    # opcode -> registers ('M' for memory) the microcode latches
+    lines = {control.AIN: 'A', control.BIN: 'B', control.CIN: 'C', control.DLIN: 'D', control.DHIN: 'D',
+             control.SGIN: 'SG', control.MIN: 'M'}
+    writes = {}
+    for table in tables:
+        for opcode, steps in table.values():
+            writes.setdefault(opcode, set()).update([lines[l] for step in steps for l in step if l in lines])
+    return writes
+
+
+TABLES = (control.INSTRUCTIONS, control.INSTRUCTIONS_CF, control.INSTRUCTIONS_ZF)
+STEPS = len(control.INSTRUCTIONS['NOP'][1])
+MICROSTEPS = microsteps(TABLES)
+MICROSTEPS_NOT_TAKEN = microsteps(TABLES[:1])
+WRITES = register_writes(TABLES)
+
+# Bytes the hardware consumes for each opcode, one per PCEN
+LENGTHS = {opcode: len([step for step in steps if control.PCEN in step])
+           for opcode, steps in control.INSTRUCTIONS.values()}
+
+
+def _unsafe(instrs, size):
+    # Reasons the program might see its own layout, which the pass would then change under it
+    for _, code, ref in instrs:
+        name = NAMES.get(code[0], '')
+        if code[0] in REGISTER_JUMPS:
+            return f'Register Jump {name}'
+        elif code[0] in (OPCODES['JMPM'], OPCODES['JC'], OPCODES['JZ']) and ref is None:
+            return f'Jump To Address {name} {code[1]:02x}'
+        elif ref is not None and not code[0] in (OPCODES['JMPM'], OPCODES['JC'], OPCODES['JZ']):
+            return f'Label Used As Data {ref}'
+        elif re.match('^(LD|ST)[A-Z]+M$', name) and code[1] < size:
+            return f'Code Accessed As Data {name} {code[1]:02x}'
+    return None
+
+
+def optimize(obj):
+    # Peephole pass between assemble and link. Returns the rewritten object code and a report of what it saved.
+    # Lines keep their place in obj.lines, dropped ones with no bytes, so listings still line up with the source.
+    refs = dict(obj.refs)
+    at = {}
+    for label, offset in obj.labels.items():
+        at.setdefault(offset, []).append(label)
+    instrs = [[at.get(offset, []), list(obj.code[offset:offset + length]), refs.get(offset + 1)]
+              for offset, length in obj.lines]
+    report = {'bytes': 0, 'microsteps': 0, 'instructions': 0, 'dropped': 0, 'rewritten': 0, 'threaded': 0}
+
+    reason = _unsafe(instrs, obj.size)
+    if reason:
+        report['skipped'] = reason
+        return obj, report
+
+    # Jumps to jumps go straight to the final target
+    index = {label: i for i, (labels, _, _) in enumerate(instrs) for label in labels}
+    index.update({label: len(instrs) for label in at.get(obj.size, [])})
+    jmp = lambda i: i < len(instrs) and instrs[i][1][0] == OPCODES['JMPM'] and instrs[i][2] is not None
+    for instr in instrs:
+        if instr[2] is None:
+            continue
+        label, seen = instr[2], set()
+        while jmp(index[label]) and not label in seen:
+            seen.add(label)
+            label = instrs[index[label]][2]
+        if label != instr[2]:
+            instr[2] = label
+            report['threaded'] += 1
+    targets = set([ref for _, _, ref in instrs if ref is not None])
+
+    # Within each block, track registers holding known values and memory holding the same value as a register
+    regs = {}
+    mem = {}
+
+    def written(r):
+        regs.pop(r, None)
+        for rs in mem.values():
+            rs.discard(r)
+
+    out = []
+    for i, (labels, code, ref) in enumerate(instrs):
+        if set(labels) & targets:
+            regs.clear()
+            mem.clear()
+        name = NAMES.get(code[0], '')
+        new = code
+        if code[0] in NOP_MOVES:
+            new = []
+        elif ref is not None and code[0] == OPCODES['JMPM'] and index[ref] == i + 1:
+            new = []
+        elif (m := re.match('^LD(A|B|C)I$', name)) and ref is None:
+            r = m.group(1)
+            if regs.get(r) == code[1]:
+                new = []
             else:
-                translation.append(target)
+                holding = [x for x in TRACKED if regs.get(x) == code[1] and f'MV{x}{r}' in OPCODES]
+                if holding:
+                    new = [OPCODES[f'MV{holding[0]}{r}']]
+        elif m := re.match('^LD(A|B)M$', name):
+            r = m.group(1)
+            holding = mem.get(code[1], set())
+            if r in holding:
+                new = []
+            elif holding & set(['A', 'B']):
+                new = [OPCODES[f'MV{sorted(holding & set(["A", "B"]))[0]}{r}']]
+
+        if new != code:
+            report['bytes'] += len(code) - len(new)
+            report['microsteps'] += MICROSTEPS[code[0]] - (MICROSTEPS[new[0]] if new else 0)
+            report['instructions'] += 0 if new else 1
+            report['dropped' if not new else 'rewritten'] += 1
+        out.append([labels, new, ref if new else None])
+        if not new:
+            continue
 
+        name = NAMES.get(new[0], '')
+        if m := re.match('^LD(A|B|C)I$', name):
+            written(m.group(1))
+            if ref is None:
+                regs[m.group(1)] = new[1]
+        elif m := re.match(f'^MV({"|".join(REGISTERS)})({"|".join(REGISTERS)})$', name):
+            src, dst = m.groups()
+            written(dst)
+            if dst in TRACKED and src in regs:
+                regs[dst] = regs[src]
+            if dst in ('A', 'B') and src in ('A', 'B'):
+                for rs in mem.values():
+                    if src in rs:
+                        rs.add(dst)
+        elif m := re.match('^LD(A|B|C|DL|DH|D|SG)M$', name):
+            written(m.group(1))
+            if m.group(1) in ('A', 'B'):
+                mem.setdefault(new[1], set()).add(m.group(1))
+        elif m := re.match('^ST(A|B|C|DL|DH|D|SG)M$', name):
+            mem[new[1]] = set([m.group(1)]) & set(['A', 'B'])
         else:
-            raise Exception(f'Unknown Mneumonic {mneumonic}')
-
-        tokens[i] = translation
-
-    return tokens
+            for r in WRITES[new[0]]:
+                written(r)
+            if 'M' in WRITES[new[0]]:
+                mem.clear()
+            if new[0] in (OPCODES['JMPM'], OPCODES['HALT']):
+                regs.clear()
+                mem.clear()
+
+    new_obj = ObjectCode(len(obj.code))
+    for labels, code, ref in out:
+        for label in labels:
+            new_obj.labels[label] = new_obj.size
+        if ref is not None:
+            new_obj.refs.append((new_obj.size + 1, ref))
+            new_obj.fixups.append((new_obj.size + 1, LabelRef(ref)))
+        new_obj.code[new_obj.size:new_obj.size + len(code)] = bytes(code)
+        new_obj.lines.append((new_obj.size, len(code)))
+        new_obj.size += len(code)
+    for label in at.get(obj.size, []):
+        new_obj.labels[label] = new_obj.size
+    return new_obj, report
+
+
+def print_optimization(report):
+    if 'skipped' in report:
+        print(f'>>>>> Optimization Skipped: {report["skipped"]}')
+        return
+    print(f'>>>>> Optimized: {report["bytes"]} Bytes, {report["microsteps"]} Microsteps Saved '
+          f'({report["dropped"]} Dropped, {report["rewritten"]} Rewritten, {report["threaded"]} Jumps Threaded; '
+          f'{report["instructions"] * STEPS} Cycles At {STEPS} Steps Per Instruction)')
+
+
+def split_instructions(address, code):
+    # (address, opcode, operand) of each instruction in a line's bytes
+    instrs = []
+    i = 0
+    while i < len(code):
+        length = max(LENGTHS.get(code[i], 1), 1)
+        instrs.append((address + i, code[i], code[i + 1] if length > 1 and i + 1 < len(code) else None))
+        i += length
+    return instrs
+
+
+def tstates(code, taken=True):
+    # Microsteps for a line, with the step counter reset after each instruction's last non-empty step when the board
+    # resets early, and all STEPS per instruction when it doesn't
+    if not control.EARLY_RESET:
+        return STEPS * len(split_instructions(0, code))
+    counts = MICROSTEPS if taken else MICROSTEPS_NOT_TAKEN
+    return sum([counts.get(opcode, STEPS) for _, opcode, _ in split_instructions(0, code)])
+
+
+def tstate_text(code):
+    taken, not_taken = tstates(code), tstates(code, taken=False)
+    return f'{taken}T' if taken == not_taken else f'{not_taken}/{taken}T'
+
+
+def jump_target(address, code):
+    # Where a line's jump goes, decoding the short, near and far forms link emits, or None
+    instrs = split_instructions(address, code)
+    if not instrs:
+        return None
+    _, opcode, operand = instrs[-1]
+    if opcode in (OPCODES['JMPM'], OPCODES['JC'], OPCODES['JZ']):
+        return operand
+    loads = {op: v for _, op, v in instrs[:-1]}
+    if opcode == OPCODES['JMPD'] and OPCODES['LDDHI'] in loads and OPCODES['LDDLI'] in loads:
+        return loads[OPCODES['LDDHI']] << 8 | loads[OPCODES['LDDLI']]
+    elif opcode == OPCODES['JMPDL'] and OPCODES['LDDLI'] in loads:
+        return address & 0xff00 | loads[OPCODES['LDDLI']]
+    return None
+
+
+def loop_costs(obj):
+    # (label, start, end, instructions, T-states) for each backward jump to a label: one pass round the loop along
+    # the straight-line path, taking the closing jump and none of the conditional jumps in between
+    names = {}
+    for label, address in obj.labels.items():
+        names.setdefault(address, label)
+    lines = [(offset, list(obj.code[offset:offset + length])) for offset, length in obj.lines if length]
+    loops = []
+    for offset, code in lines:
+        target = jump_target(offset, code)
+        if target is None or target > offset or not target in names:
+            continue
+        body = [(o, c) for o, c in lines if target <= o < offset]
+        count = sum([len(split_instructions(o, c)) for o, c in body]) + len(split_instructions(offset, code))
+        cost = sum([tstates(c, taken=False) for _, c in body]) + tstates(code)
+        loops.append((names[target], target, offset, count, cost))
+    return loops
+
+
+def print_loops(loops):
+    if not loops:
+        return
+    print('Loops:')
+    for label, start, end, count, cost in loops:
+        print(f'  {label:<20}  [ {start:04x} - {end:04x} ]  {count:>3} Instructions  {cost:>4}T  '
+              f'({count * STEPS}T At {STEPS} Steps)')
+    print()
 
 
-def link(object_code):
-    labels = {}
-    machine_code = []
-    offset = 0
-    for i in range(0, len(object_code)):
-        if len(object_code[i]) == 1 and type(object_code[i][0]) == Label:
-            labels[object_code[i][0].label] = offset
-            continue
-        machine_code.append(object_code[i])
-        offset += len(object_code[i])
-    for i in range(0, len(machine_code)):
-        for j in range(0, len(machine_code[i])):
-            if type(machine_code[i][j]) == LabelRef:
-                if not machine_code[i][j].label in labels:
-                    raise Exception(f'Unmatched Label Reference {machine_code[i][j].label}')
-                machine_code[i][j] = labels[machine_code[i][j].label]
+INCLUDE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.8bitcpu', 'include')
 
-    return machine_code
+MACRO_DEPTH = 16
 
+DIRECTIVE_PATTERN = re.compile(r'^\.([a-zA-Z]+)\s*(.*)$')
+NAME_PATTERN = re.compile(r'(?<![\w\-])[a-zA-Z][a-zA-Z0-9\-_]*')
 
-def read_lines(source_file):
-    with open(source_file, 'r') as f:
-        file_lines = f.readlines()
 
-    for i in range(0, len(file_lines)):
-        l = file_lines[i]
-        l = l.strip()
-        l = l.split('#', maxsplit=1)[0]
-        file_lines[i] = l.strip()
+class Line(str):
+    # Source line, still usable as a plain str, with its line number and the column its text starts at in the source
+    # file. Lines expanded from a macro or include carry the position of the line that invoked them, as expanded.
+    def __new__(cls, text, line=0, col=1, expanded=False):
+        l = super().__new__(cls, text)
+        l.line = line
+        l.col = col
+        l.expanded = expanded
+        return l
 
-    file_lines = [l for l in file_lines if len(l)]
-    return file_lines
 
+def strip_lines(lines):
+    for i, l in enumerate(lines, 1):
+        l = l.split('#', maxsplit=1)[0].rstrip()
+        text = l.lstrip()
+        if len(text):
+            yield Line(text, i, len(l) - len(text) + 1)
 
-def parse(file_lines):
-    tokens = []
-
-    def _translate(t):
-        if t.startswith('*'):
-            t = _translate(t[1:])
-            if type(t) not in [Register, Value]:
-                raise Exception(f'Memory Syntax Error: *0x10')
-            t = Memory(t)
-        elif t.isdigit():
-            t = Value(int(t))
-        elif t.startswith('0x') and re.match('[0-9a-fA-F]+', t[2:]):
-            t = Value(int(t, 16))
-        elif re.match('^[a-zA-Z]{1}[a-zA-Z0-9\-_]+:$', t):
-            t = Label(t[:-1])
-        elif t.startswith('R'):
-            t = Register(t[1:])
-        elif j > 0 and re.match('^[a-zA-Z]{1}[a-zA-Z0-9\-_]+$', t):
-            t = LabelRef(t)
-        return t
 
-    for i in range(0, len(file_lines)):
-        l_tokens = file_lines[i].split(' ')
-        for j in range(0, len(l_tokens)):
-            l_tokens[j] = _translate(l_tokens[j])
+def statements(lines):
+    # Yields the source as ['line', text], ['equ', name, value], ['include', path] and
+    # ['macro', name, [params], [body lines]]
+    lines = iter(lines)
+    for l in lines:
+        m = DIRECTIVE_PATTERN.match(l)
+        if m is None:
+            yield ['line', l]
+            continue
+        directive, args = m.group(1).lower(), m.group(2).split()
+        if directive == 'equ' and len(args) == 2:
+            yield ['equ', args[0], args[1]]
+        elif directive == 'include' and len(args) == 1:
+            yield ['include', args[0].strip('"\''), l]
+        elif directive == 'macro' and len(args) >= 1:
+            body = []
+            for b in lines:
+                if b.lower() == '.endm':
+                    break
+                elif b.lower().startswith('.macro'):
+                    raise Exception(f'Nested Macro In {args[0]}')
+                body.append(b)
+            else:
+                raise Exception(f'Unterminated Macro {args[0]}')
+            yield ['macro', args[0], args[1:], body]
+        else:
+            raise Exception(f'Invalid Directive {l}')
+
+
+class Preprocessor:
+    # Expands .include, .macro/.endm and .equ ahead of parse. Included files are kept as parsed statements, in
+    # memory and under INCLUDE_CACHE_DIR, keyed by path and checked by mtime then content hash, so an unchanged
+    # library is not re-parsed by every build. Expansion depends on the definitions in effect, so it is redone.
+    def __init__(self, cache_dir=INCLUDE_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.cache = {}
+        self.files = set()
+
+    def cache_path(self, path):
+        return os.path.join(self.cache_dir, hashlib.sha1(path.encode()).hexdigest() + '.json')
+
+    def load(self, path):
+        path = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime_ns
+        entry = self.cache.get(path)
+        if entry is None and self.cache_dir and os.path.exists(self.cache_path(path)):
+            with open(self.cache_path(path), 'r') as f:
+                entry = json.load(f)
+        if entry is not None and entry[0] == mtime:
+            self.cache[path] = entry
+            return entry[2]
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if entry is not None and entry[1] == digest:
+            entry = [mtime, digest, entry[2]]
+        else:
+            entry = [mtime, digest, list(statements(strip_lines(data.decode().splitlines())))]
+        self.cache[path] = entry
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self.cache_path(path), 'w') as f:
+                json.dump(entry, f)
+        return entry[2]
+
+    def expand(self, source_file):
+        # Yields the expanded lines of source_file, streaming the file itself and loading only its includes
+        self.files = set([os.path.abspath(source_file)])
+        self.equs = {}
+        self.macros = {}
+        self.expansions = 0
+        with open(source_file, 'r') as f:
+            yield from self.statements(statements(strip_lines(f)), source_file, [os.path.abspath(source_file)])
+
+    def statements(self, stmts, source_file, stack, at=None):
+        # at is the line of the source file that included these statements, if they came from another file
+        for stmt in stmts:
+            if stmt[0] == 'line':
+                yield from self.line(stmt[1], 0, at)
+            elif stmt[0] == 'equ':
+                self.equs[stmt[1]] = self.substitute(stmt[2], self.equs)
+            elif stmt[0] == 'macro':
+                self.macros[stmt[1]] = (stmt[2], stmt[3])
+            else:
+                path = os.path.abspath(os.path.join(os.path.dirname(source_file), stmt[1]))
+                if path in stack:
+                    raise Exception(f'Recursive Include {stmt[1]}')
+                self.files.add(path)
+                yield from self.statements(self.load(path), path, stack + [path], at or stmt[2])
+
+    def substitute(self, text, names):
+        return NAME_PATTERN.sub(lambda m: names.get(m.group(0), m.group(0)), text)
+
+    def line(self, text, depth, at=None):
+        # Lines yielded take their position from text, or from at, the source line whose expansion they are part of
+        source = at or text
+        text = self.substitute(text, self.equs)
+        name, args = text.split()[0], text.split()[1:]
+        if not name in self.macros:
+            yield Line(text, getattr(source, 'line', 0), getattr(source, 'col', 1), at is not None)
+            return
+        if depth >= MACRO_DEPTH:
+            raise Exception(f'Macro Expansion Too Deep {name}')
+        params, body = self.macros[name]
+        if len(args) != len(params):
+            raise Exception(f'Macro {name} Takes {len(params)} Arguments, Got {len(args)}')
+        # '@' in a macro body becomes a suffix unique to the expansion, for labels local to it
+        self.expansions += 1
+        names = dict(zip(params, args))
+        for b in body:
+            yield from self.line(self.substitute(b, names).replace('@', f'_{self.expansions}'), depth + 1, source)
+
+
+PREPROCESSOR = Preprocessor()
+
+
+def read_lines(source_file, preprocessor=PREPROCESSOR):
+    # Yields the non-empty lines of the source with comments stripped and directives expanded, one at a time
+    return preprocessor.expand(source_file)
+
+
+TOKEN_PATTERN = re.compile(r"""[ \t]*(?:
+      (?P<Name>[a-zA-Z][a-zA-Z0-9\-_]*)(?P<Label>:)?
+    | (?P<Hex>0x[0-9a-fA-F]+)
+    | (?P<Decimal>[0-9]+)
+    | \*(?P<Memory>R[a-zA-Z]+|0x[0-9a-fA-F]+|[0-9]+)
+    | (?P<Comment>\#.*)
+    | (?P<Error>\S+)
+)(?=[\s\#]|$)""", re.VERBOSE)
+
+
+def _operand(text, line, col):
+    if text.startswith('0x'):
+        return Value(int(text, 16), line, col)
+    elif text.isdigit():
+        return Value(int(text), line, col)
+    return Register(text[1:], line, col)
+
+
+def tokenize(file_lines):
+    # Yields (line number, [tokens]) for each line holding any. One match of the compiled pattern per token, so
+    # tokens may be separated by any run of spaces and tabs. Positions are in the source file when the lines carry
+    # them (see Line), with every token of an expanded line at the line that invoked it.
+    for i, l in enumerate(file_lines, 1):
+        n = getattr(l, 'line', 0) or i
+        base = getattr(l, 'col', 1)
+        expanded = getattr(l, 'expanded', False)
+        l_tokens = []
+        for m in TOKEN_PATTERN.finditer(l):
+            kind = m.lastgroup
+            col = base if expanded else base + m.start('Name' if kind == 'Label' else kind)
+            if kind == 'Name':
+                text = m.group(kind)
+                if not l_tokens:
+                    t = Mnemonic(text, n, col)
+                elif text[0] == 'R':
+                    t = Register(text[1:], n, col)
+                else:
+                    t = LabelRef(text, n, col)
+            elif kind == 'Hex':
+                t = Value(int(m.group(kind), 16), n, col)
+            elif kind == 'Decimal':
+                t = Value(int(m.group(kind)), n, col)
+            elif kind == 'Memory':
+                t = Memory(_operand(m.group(kind), n, col), n, col if expanded else col - 1)
+            elif kind == 'Label':
+                t = Label(m.group('Name'), n, col)
+            elif kind == 'Comment':
+                break
+            else:
+                raise Exception(f'Syntax Error At {n}:{col} {m.group(kind)}')
+            l_tokens.append(t)
+        if l_tokens:
+            yield n, l_tokens
 
-        tokens.append(l_tokens)
 
-    return tokens
+def parse(file_lines):
+    for _, l_tokens in tokenize(file_lines):
+        yield l_tokens
 
 
-def print_assembly(file_lines, machine_lines, machine_code):
+def print_assembly(file_lines, machine_lines, machine_code, addresses=None, cycles=False, histogram=None):
+    # cycles adds each line's T-states (not taken / taken for conditional jumps), histogram ({address: [executions,
+    # cycles]} from an emulator run) what it actually cost
     print()
 
+    total = sum([c for _, c in histogram.values()]) if histogram else 0
     j = 0
     k = 0
     for i in range(0, len(file_lines)):
-        if re.match('^[a-zA-Z]{1}[a-zA-Z0-9\-_]+:$', file_lines[i]):
+        if addresses and j < len(addresses):
+            k = addresses[j]
+        if re.match('^[a-zA-Z]{1}[a-zA-Z0-9\-_]*:$', file_lines[i]):
             print(file_lines[i])
         else:
             machine_line = ' '.join([f'{v:02x}' for v in machine_lines[j]])
             pad = (5 - len(machine_line)) * ' '
-            print(f'  [ {k:04x} ]  {machine_line}{pad}    {file_lines[i]}')
+            annotation = ''
+            if cycles:
+                annotation += f'{tstate_text(machine_lines[j]) if machine_lines[j] else "":>6}  '
+            if histogram:
+                hits = [histogram.get(a, [0, 0]) for a, _, _ in split_instructions(k, machine_lines[j])]
+                executions, spent = max([h[0] for h in hits] + [0]), sum([h[1] for h in hits])
+                annotation += f'{executions:>9} {spent:>11} {100 * spent / max(total, 1):5.1f}%  '
+            print(f'  [ {k:04x} ]  {machine_line}{pad}    {annotation}{file_lines[i]}')
             k += len(machine_lines[j])
             j += 1
 
     print()
+    import at28c256  # The EEPROM programmer driver, only for its hexdump
     at28c256.hexdump(machine_code)
     print()
 
 
+def write_symbols(symbols_file, labels):
+    # One '<address> <label>' line per label, in address order
+    with open(symbols_file, 'w') as f:
+        for label, address in sorted(labels.items(), key=lambda l: (l[1], l[0])):
+            print(f'{address:04x} {label}', file=f)
+
+
+def build(source_file):
+    file_lines = list(read_lines(source_file))
+    obj = assemble(parse(file_lines))
+    machine_code = link(obj)
+    return file_lines, obj.machine_lines(), machine_code, obj.labels
+
+
+def build_stream(source_file):
+    # Streams the source through parse and assemble without holding its lines, for sources too large to list
+    obj = assemble(parse(read_lines(source_file)))
+    return link(obj), obj.labels
+
+
+class IncrementalAssembler:
+    def __init__(self):
+        self.cache = {}
+        self.file_lines = []
+        self.templates = []
+        self.offsets = [0]
+        self.labels = {}
+        self.machine_code = b''
+        self.obj = None
+
+    def template(self, line):
+        # Parsed and assembled form of a source line, cached by its content: (label, code, ((offset, label), ...))
+        t = self.cache.get(line)
+        if t is None:
+            o = assemble(parse([line]), ObjectCode(16))
+            if o.labels:
+                t = (list(o.labels.keys())[0], b'', ())
+            else:
+                t = (None, bytes(o.code[:o.size]), tuple([(j, ref.label) for j, ref in o.fixups]))
+            self.cache[line] = t
+        return t
+
+    def update(self, file_lines):
+        file_lines = list(file_lines)
+        templates = [self.template(l) for l in file_lines]
+        if self.obj is not None:
+            # The last build was linked across segments, so none of its bytes can be reused
+            self.file_lines, self.offsets, self.labels, self.machine_code = [], [0], {}, b''
+
+        n, m = len(self.file_lines), len(file_lines)
+        k = 0
+        while k < min(n, m) and self.file_lines[k] == file_lines[k]:
+            k += 1
+        s = 0
+        while s < min(n, m) - k and self.file_lines[n - 1 - s] == file_lines[m - 1 - s]:
+            s += 1
+
+        offsets = [0] * (m + 1)
+        labels = {}
+        offset = 0
+        for i in range(0, m):
+            offsets[i] = offset
+            if templates[i][0] is not None:
+                if templates[i][0] in labels:
+                    raise Exception(f'Duplicate Label{_position([file_lines[i]])} {templates[i][0]}')
+                labels[templates[i][0]] = offset
+            offset += len(templates[i][1])
+        offsets[m] = offset
+
+        if offset > SEGMENT_SIZE or any([address > 0xff for address in labels.values()]):
+            # Past one segment (or with a label just past it) the jump forms depend on the whole layout, so link it
+            # all again
+            self.obj = assemble(parse(file_lines))
+            self.machine_code = link(self.obj)
+            self.labels = self.obj.labels
+            return self.machine_code
+
+        # Unchanged leading and trailing lines keep their previously linked bytes, so only references in the edited
+        # lines, or to labels that have moved, need resolving again.
+        machine_code = bytearray(
+            self.machine_code[:self.offsets[k]] +
+            b''.join([t[1] for t in templates[k:m - s]]) +
+            self.machine_code[self.offsets[n - s]:])
+        for i in range(0, m):
+            for j, label in templates[i][2]:
+                if not label in labels:
+                    raise Exception(f'Unmatched Label Reference {label}')
+                if k <= i < m - s or labels[label] != self.labels.get(label):
+                    machine_code[offsets[i] + j] = labels[label]
+
+        self.file_lines = list(file_lines)
+        self.templates = templates
+        self.offsets = offsets
+        self.labels = labels
+        self.machine_code = bytes(machine_code)
+        self.obj = None
+        return self.machine_code
+
+    def machine_lines(self):
+        if self.obj is not None:
+            return self.obj.machine_lines()
+        return [
+            list(self.machine_code[self.offsets[i]:self.offsets[i + 1]])
+                for i in range(0, len(self.templates)) if self.templates[i][0] is None
+        ]
+
+
+def _mtimes(files):
+    try:
+        return tuple([os.stat(f).st_mtime_ns for f in files])
+    except OSError:
+        return None
+
+
+def watch(args):
+    bin_file = args.out or os.path.splitext(args.file)[0] + '.bin'
+    inc = IncrementalAssembler()
+    b = None
+    if args.port:
+        b = bootstrap.Bootstrap(args.port, shadow=bootstrap.Shadow(args.port))
+        b.enable()
+
+    mtime = None
+    files = [args.file]
+    try:
+        while True:
+            t = _mtimes(files)
+            if t == mtime:
+                time.sleep(0.05)
+                continue
+            mtime = t
+
+            start = time.perf_counter()
+            try:
+                machine_code = inc.update(read_lines(args.file))
+            except Exception as e:
+                print(f'>>>>> Error: {e}')
+                continue
+            finally:
+                # Includes are watched too, as found by the last build
+                if sorted(PREPROCESSOR.files) != files:
+                    files = sorted(PREPROCESSOR.files)
+                    mtime = _mtimes(files)
+            with open(bin_file, 'wb') as f:
+                f.write(machine_code)
+            if args.symbols:
+                write_symbols(args.symbols, inc.labels)
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f'>>>>> Assembled {len(machine_code)} Bytes In {elapsed:.1f}ms -> {bin_file}')
+
+            if b:
+                runs = b.write_delta(0, machine_code)
+                b.shadow.save()
+                print('>>>>> Delta Upload:', sum([len(d) for _, d in runs]), 'Bytes In', len(runs), 'Runs')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if b:
+            b.__exit__(None, None, None)
+
+
 def run(args):
+    control.EARLY_RESET = args.early_reset
     source_file = args.file
     bin_file = os.path.splitext(args.file)[0] + '.bin'
 
-    file_lines = read_lines(source_file)
-    tokens = parse(file_lines)
-    object_lines = assemble(tokens)
-    machine_lines = link(object_lines)
-    machine_code = b''.join([bytes(b) for b in machine_lines])
-
-    print_assembly(file_lines, machine_lines, machine_code)
+    if args.watch:
+        watch(args)
+        return
+
+    file_lines = None if args.quiet else list(read_lines(source_file))
+    obj = assemble(parse(read_lines(source_file) if file_lines is None else file_lines))
+    if args.optimize:
+        obj, report = optimize(obj)
+    machine_code, labels = link(obj), obj.labels
+    histogram = None
+    if args.profile:
+        m = cpuemu.Machine(machine_code)
+        histogram = profile(m, args.profile)
+    if file_lines is None:
+        print(f'>>>>> Assembled {len(machine_code)} Bytes')
+    else:
+        print_assembly(file_lines, obj.machine_lines(), machine_code, [offset for offset, _ in obj.lines],
+                       args.cycles, histogram)
+    if args.cycles:
+        print_loops(loop_costs(obj))
+    if args.optimize:
+        print_optimization(report)
+    if histogram is not None:
+        print(f'>>>>> Profiled {m.cycles} Cycles, {m.instructions} Instructions, '
+              f'{"Halted" if m.halted else "Running"} At {m.seg << 8 | m.pc:04x}')
+
+    if args.symbols:
+        write_symbols(args.symbols, labels)
 
     if args.emulator:
         t = tempfile.NamedTemporaryFile('wb', delete=False)
@@ -277,8 +1090,22 @@ def run(args):
             f.write(machine_code)
 
     if args.port:
-        with bootstrap.Bootstrap(args.port) as b:
-            b.write_range(0, machine_code)
+        shadow = bootstrap.Shadow(args.port)
+        if args.full:
+            shadow.reset()
+        with bootstrap.Bootstrap(args.port, shadow=shadow) as b:
+            if args.delta:
+                runs = b.write_delta(0, machine_code)
+                print('>>>>> Delta Upload:', sum([len(d) for _, d in runs]), 'Bytes In', len(runs), 'Runs')
+            else:
+                b.write_range(0, machine_code)
+            if args.acknowledged:
+                missing = shadow.unacknowledged(0, machine_code)
+                for address, length in missing:
+                    print(f'>>>>> Unacknowledged [ {address:04x} ] {length} Bytes')
+                if missing:
+                    raise Exception('Upload Not Acknowledged')
+                print('>>>>> All Bytes Acknowledged')
         print()
 
     if args.romh:
@@ -291,10 +1118,20 @@ def run(args):
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Assembler.')
+    parser.add_argument('--acknowledged', dest='acknowledged', action='store_true')
+    parser.add_argument('--cycles', dest='cycles', action='store_true')
+    parser.add_argument('--delta', dest='delta', action='store_true')
     parser.add_argument('--emulator', dest='emulator', default='', type=str)
+    parser.add_argument('--full', dest='full', action='store_true')
+    parser.add_argument('--no-early-reset', dest='early_reset', action='store_false')
+    parser.add_argument('--optimize', dest='optimize', action='store_true')
     parser.add_argument('--out', dest='out', default='', type=str)
+    parser.add_argument('--profile', dest='profile', default=0, type=int)
     parser.add_argument('--program', dest='port', default='', type=str)
+    parser.add_argument('--quiet', dest='quiet', action='store_true')
     parser.add_argument('--romh', dest='romh', default='', type=str)
+    parser.add_argument('--symbols', dest='symbols', default='', type=str)
+    parser.add_argument('--watch', dest='watch', action='store_true')
     parser.add_argument('file', type=str)
     args = parser.parse_args()
 
@@ -0,0 +1,63 @@
+import argparse
+import re
+import time
+
+from assembler import assembler
+
+
+def legacy_parse(file_lines):
+    # The split-on-space parser the tokenizer replaced, kept as the benchmark baseline
+    tokens = []
+
+    def _translate(t, j):
+        if t.startswith('*'):
+            t = _translate(t[1:], j)
+            if type(t) not in [assembler.Register, assembler.Value]:
+                raise Exception(f'Memory Syntax Error: *0x10')
+            t = assembler.Memory(t)
+        elif t.isdigit():
+            t = assembler.Value(int(t))
+        elif t.startswith('0x') and re.match('[0-9a-fA-F]+', t[2:]):
+            t = assembler.Value(int(t, 16))
+        elif re.match('^[a-zA-Z]{1}[a-zA-Z0-9\-_]+:$', t):
+            t = assembler.Label(t[:-1])
+        elif t.startswith('R'):
+            t = assembler.Register(t[1:])
+        elif j > 0 and re.match('^[a-zA-Z]{1}[a-zA-Z0-9\-_]+$', t):
+            t = assembler.LabelRef(t)
+        return t
+
+    for l in file_lines:
+        tokens.append([_translate(t, j) for j, t in enumerate(l.split(' '))])
+
+    return tokens
+
+
+def generate(n):
+    # n lines of single-spaced source touching every token type, parseable by both paths
+    body = ['LD 0x01 RA', 'LD 200 RB', 'ADD', 'ST RA *0xfe', 'LD *RC RB', 'MV RA RC', 'JZ loop_{}', 'JMP start']
+    lines = ['start:']
+    while len(lines) < n:
+        lines.append(f'loop_{len(lines)}:')
+        lines += [l.format(len(lines) - 1) for l in body]
+    return lines[:n]
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Assembler Parse Benchmark.')
+    parser.add_argument('--lines', dest='lines', default=100000, type=int)
+    parser.add_argument('--repeat', dest='repeat', default=3, type=int)
+    args = parser.parse_args()
+
+    file_lines = generate(args.lines)
+    print()
+    for name, f in (('legacy', legacy_parse), ('tokenizer', lambda l: list(assembler.parse(l)))):
+        elapsed = min([timed(f, file_lines) for _ in range(0, args.repeat)])
+        print(f'{name:>10}  {len(file_lines)} Lines In {elapsed:.3f}s ({len(file_lines) / elapsed:,.0f} Lines/s)')
+    print()
@@ -0,0 +1,273 @@
+import argparse
+import asyncio
+import os
+import struct
+import termios
+import time
+import tty
+
+from bootstrap.bootstrap import BLOCK_RETRIES, BLOCK_SIZE, RESYNC_DELAY_S
+
+
+BAUD = 115200
+
+BANNER_TIMEOUT_S = 4.0
+# setup() in bootstrap.ino waits this long after printing its banner before it reads any command
+SETUP_DELAY_S = 2.5
+TIMEOUT_S = 2.0
+RETRIES = 3
+
+
+class AsyncSerial(object):
+    # Non-blocking serial port for Linux: a raw tty opened O_NONBLOCK, read through the event loop's reader callback
+    # into a buffer that read() waits on.
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.buffer = bytearray()
+        self.waiter = None
+        self.error = None
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(fd, self.readable)
+
+    @staticmethod
+    async def open(port, baud=BAUD):
+        fd = os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            tty.setraw(fd, termios.TCSANOW)
+            attrs = termios.tcgetattr(fd)
+            attrs[2] |= termios.CLOCAL | termios.CREAD
+            attrs[4] = attrs[5] = getattr(termios, f'B{baud}')
+            termios.tcsetattr(fd, termios.TCSANOW, attrs)
+        except Exception:
+            os.close(fd)
+            raise
+        return AsyncSerial(fd)
+
+    def readable(self):
+        try:
+            data = os.read(self.fd, 4096)
+            if not data:
+                raise EOFError('Serial Port Closed')
+            self.buffer += data
+        except BlockingIOError:
+            return
+        except Exception as e:
+            self.error = e
+            self.loop.remove_reader(self.fd)
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def wait(self, ready, timeout):
+        deadline = self.loop.time() + timeout
+        while not ready():
+            if self.error is not None:
+                raise self.error
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            self.waiter = self.loop.create_future()
+            try:
+                await asyncio.wait_for(self.waiter, remaining)
+            finally:
+                self.waiter = None
+
+    async def read(self, n=1, timeout=TIMEOUT_S):
+        await self.wait(lambda: len(self.buffer) >= n, timeout)
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    async def readline(self, timeout=TIMEOUT_S):
+        await self.wait(lambda: b'\n' in self.buffer, timeout)
+        n = self.buffer.index(b'\n') + 1
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    async def write(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self.fd, view):]
+            except BlockingIOError:
+                ready = self.loop.create_future()
+                self.loop.add_writer(self.fd, lambda: ready.done() or ready.set_result(None))
+                try:
+                    await ready
+                finally:
+                    self.loop.remove_writer(self.fd)
+
+    def reset_input_buffer(self):
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+        self.buffer.clear()
+
+    def close(self):
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = None
+
+
+class AsyncBootstrap(object):
+    # Bootstrap over AsyncSerial, with the same commands. Every acknowledgement is awaited with timeout.
+
+    def __init__(self, serial, shadow=None, timeout=TIMEOUT_S):
+        self.serial = serial
+        self.shadow = shadow
+        self.timeout = timeout
+        self.banner = None
+
+    @staticmethod
+    async def open(port, shadow=None, timeout=TIMEOUT_S, banner_timeout=BANNER_TIMEOUT_S, setup_delay=SETUP_DELAY_S):
+        # Opening the port resets the Arduino, which announces itself once it is up and then waits out setup_delay
+        # before answering, longer than timeout allows. A board that doesn't announce itself (e.g. with auto reset
+        # disabled) is assumed to be running already.
+        b = AsyncBootstrap(await AsyncSerial.open(port), shadow, timeout)
+        try:
+            b.banner = (await b.serial.readline(banner_timeout)).decode('ascii', 'replace').strip()
+        except asyncio.TimeoutError:
+            return b
+        await asyncio.sleep(setup_delay)
+        return b
+
+    async def __aenter__(self):
+        await self.enable()
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        try:
+            if type is None:
+                await self.disable()
+        finally:
+            if self.shadow:
+                self.shadow.save()
+            self.close()
+
+    def close(self):
+        self.serial.close()
+
+    async def enable(self):
+        await self.serial.write(b'\x01')
+        return await self.serial.read(1, self.timeout)
+
+    async def disable(self):
+        await self.serial.write(b'\x02')
+        return await self.serial.read(1, self.timeout)
+
+    async def output(self, address):
+        # The firmware holds the address on the bus for a second before acknowledging
+        await self.serial.write(b'\x03' + struct.pack('<H', address & 0x7fff))
+        return (await self.serial.read(1, self.timeout + 1.0))[0]
+
+    async def write(self, address, value):
+        await self.serial.write(b'\x04' + struct.pack('<HB', address & 0x7fff, value & 0xff))
+        echo = (await self.serial.read(1, self.timeout))[0]
+        if self.shadow and echo == address & 0xff:
+            self.shadow.update(address, bytes([value & 0xff]))
+        return echo
+
+    async def write_block(self, address, data):
+        if len(data) > BLOCK_SIZE:
+            raise Exception(f'Block Too Large {len(data)}')
+        header = struct.pack('<HB', address & 0x7fff, len(data))
+        checksum = sum(header + data) & 0xff
+        await self.serial.write(b'\x05' + header + data + bytes([checksum]))
+        if (await self.serial.read(1, self.timeout))[0] != checksum:
+            return False
+        if self.shadow:
+            self.shadow.update(address, data)
+        return True
+
+    async def write_range(self, address, data, progress=None):
+        for i in range(0, len(data), BLOCK_SIZE):
+            block = bytes(data[i:i + BLOCK_SIZE])
+            for _ in range(0, BLOCK_RETRIES):
+                try:
+                    if await self.write_block(address + i, block):
+                        break
+                except asyncio.TimeoutError:
+                    pass
+                await self.resync()
+            else:
+                raise Exception(f'Block Write Failed At {address + i:04x}')
+            if progress:
+                progress(i + len(block), len(data))
+
+    async def resync(self):
+        # Let the firmware time out of any partially received command, then drop whatever it echoed meanwhile.
+        await asyncio.sleep(RESYNC_DELAY_S)
+        self.serial.reset_input_buffer()
+
+
+async def upload(port, image, address=0, retries=RETRIES, timeout=TIMEOUT_S, banner_timeout=BANNER_TIMEOUT_S,
+                 setup_delay=SETUP_DELAY_S, progress=None, log=None):
+    # Writes image to one board, reopening the port and starting over up to retries times. Returns the attempt
+    # that succeeded, raising the last error if none did.
+    for attempt in range(1, retries + 1):
+        try:
+            b = await AsyncBootstrap.open(port, timeout=timeout, banner_timeout=banner_timeout, setup_delay=setup_delay)
+            try:
+                async with b:
+                    await b.write_range(address, image, progress)
+            finally:
+                b.close()
+            return attempt
+        except Exception as e:
+            if log:
+                log(f'{port}: Attempt {attempt} Failed: {type(e).__name__} {e}')
+            if attempt == retries:
+                raise
+
+
+async def fan_out(ports, image, address=0, retries=RETRIES, timeout=TIMEOUT_S, banner_timeout=BANNER_TIMEOUT_S,
+                  setup_delay=SETUP_DELAY_S, progress=None, log=None):
+    # Uploads image to every port at once. Returns {port: attempts taken, or the exception it failed with}.
+    results = await asyncio.gather(*[
+        upload(port, image, address, retries, timeout, banner_timeout, setup_delay,
+               (lambda n, total, p=port: progress(p, n, total)) if progress else None, log)
+        for port in ports
+    ], return_exceptions=True)
+    return dict(zip(ports, results))
+
+
+def run(args):
+    with open(args.file, 'rb') as f:
+        image = f.read()
+    ports = args.ports.split(',')
+    status = {port: 0 for port in ports}
+    messages = []
+
+    def show(port, n, total):
+        status[port] = n
+        print('\r>>>>> ' + '  '.join([f'{p}: {100 * status[p] // (total or 1):3}%' for p in ports]), end='', flush=True)
+
+    start = time.perf_counter()
+    results = asyncio.run(fan_out(ports, image, args.address, args.retries, args.timeout, args.banner_timeout,
+                                  args.setup_delay, show, messages.append))
+    elapsed = time.perf_counter() - start
+    print()
+    for message in messages:
+        print('>>>>>', message)
+    for port, result in results.items():
+        if isinstance(result, BaseException):
+            print(f'>>>>> {port}: Failed: {type(result).__name__} {result}')
+        else:
+            print(f'>>>>> {port}: {len(image)} Bytes OK ({result} Attempt{"s" if result > 1 else ""})')
+    print(f'>>>>> {len(ports)} Boards In {elapsed:.2f}s')
+    return all([not isinstance(r, BaseException) for r in results.values()])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='8bitcpu Bootstrap Fan-Out Upload.')
+    parser.add_argument('--address', dest='address', default=0, type=lambda x: int(x, 0))
+    parser.add_argument('--banner-timeout', dest='banner_timeout', default=BANNER_TIMEOUT_S, type=float)
+    parser.add_argument('--retries', dest='retries', default=RETRIES, type=int)
+    parser.add_argument('--setup-delay', dest='setup_delay', default=SETUP_DELAY_S, type=float)
+    parser.add_argument('--timeout', dest='timeout', default=TIMEOUT_S, type=float)
+    parser.add_argument('ports', type=str)
+    parser.add_argument('file', type=str)
+    args = parser.parse_args()
+
+    if not run(args):
+        raise SystemExit(1)
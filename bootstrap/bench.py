@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from bootstrap import aio
+from bootstrap.bootstrap import Bootstrap, Shadow
+from bootstrap.simulator import BAUD, DELAY_US, Simulator, Timing
+
+
+def changed(image, fraction, seed=0):
+    # image with about fraction of its bytes changed, in short runs, as an edit and reassemble would leave it
+    r = random.Random(seed)
+    data = bytearray(image)
+    target = int(len(data) * fraction)
+    count = 0
+    while count < target:
+        start = r.randrange(0, len(data))
+        for i in range(start, min(start + r.randint(1, 8), len(data))):
+            data[i] ^= 0xff
+            count += 1
+    return bytes(data)
+
+
+def block(b, image):
+    b.write_range(0, image)
+
+
+def pipelined(b, image):
+    b.write_range_pipelined(0, image)
+
+
+def lockstep(b, image):
+    b.write_range_lockstep(0, image)
+
+
+def delta(b, image):
+    b.write_delta(0, image)
+
+
+STRATEGIES = {
+    'block': block,
+    'pipelined': pipelined,
+    'lockstep': lockstep,
+    'delta': delta,
+}
+
+
+def bench(name, image, timing, scale, fraction):
+    # Uploads image to a fresh Simulator with one strategy. Returns (simulated seconds, overruns, verified). Time is
+    # measured on the host, so its own overhead is scaled up along with everything else when scale < 1.
+    with Simulator(timing, scale) as s, tempfile.TemporaryDirectory() as shadow_dir:
+        if name == 'delta':
+            previous = changed(image, fraction)
+            s.memory[:len(image)] = previous
+            shadow = Shadow(s.port, path=os.path.join(shadow_dir, 'shadow.bin'))
+            shadow.update(0, previous)
+        else:
+            shadow = None
+
+        if name == 'async':
+            async def upload():
+                b = await aio.AsyncBootstrap.open(s.port, setup_delay=timing.setup_delay_ms / 1000 * scale)
+                try:
+                    async with b:
+                        start = time.perf_counter()
+                        await b.write_range(0, image)
+                        return time.perf_counter() - start
+                finally:
+                    b.close()
+            elapsed = asyncio.run(upload())
+        else:
+            b = Bootstrap(s.port, shadow=shadow)
+            try:
+                with b:
+                    start = time.perf_counter()
+                    STRATEGIES[name](b, image)
+                    elapsed = time.perf_counter() - start
+            finally:
+                b.serial.close()
+        return elapsed / scale, s.overruns, bytes(s.memory[:len(image)]) == image
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bootstrap Upload Benchmark (Simulated Board).')
+    parser.add_argument('--baud', dest='baud', default=BAUD, type=int)
+    parser.add_argument('--changed', dest='changed', default=0.05, type=float)
+    parser.add_argument('--delay-us', dest='delay_us', default=DELAY_US, type=float)
+    parser.add_argument('--scale', dest='scale', default=1.0, type=float)
+    parser.add_argument('--size', dest='size', default=1024, type=int)
+    parser.add_argument('--strategies', dest='strategies', default=','.join(list(STRATEGIES) + ['async']), type=str)
+    args = parser.parse_args()
+
+    image = bytes(random.Random(1).randrange(0, 0x100) for _ in range(0, args.size))
+    timing = Timing(delay_us=args.delay_us, baud=args.baud)
+    print()
+    print(f'  {"Strategy":<10}  {"Bytes":>6}  {"Seconds":>8}  {"Bytes/s":>8}  {"Overruns":>8}  Verified')
+    failures = 0
+    for name in args.strategies.split(','):
+        try:
+            elapsed, overruns, verified = bench(name, image, timing, args.scale, args.changed)
+        except Exception as e:
+            failures += 1
+            print(f'  {name:<10}  {len(image):>6}  Failed: {type(e).__name__} {e}')
+            continue
+        failures += not verified
+        print(f'  {name:<10}  {len(image):>6}  {elapsed:8.3f}  {len(image) / elapsed:8.0f}  {overruns:>8}  '
+              f'{"OK" if verified else "FAILED"}')
+    print()
+
+    if failures:
+        raise SystemExit(1)
@@ -1,10 +1,94 @@
+import os
+import re
 import serial
 import struct
+import time
+
+
+MEMORY_SIZE = 0x8000
+
+BLOCK_SIZE = 64
+BLOCK_RETRIES = 4
+
+# HardwareSerial's 64 byte receive ring keeps one slot free, so 63 bytes can wait: 15 four byte 0x04 commands
+RX_BUFFER_SIZE = 63
+PIPELINE_WINDOW = RX_BUFFER_SIZE // 4
+
+RESYNC_DELAY_S = 1.1
+
+DELTA_GAP = 2
+
+SHADOW_DIR = os.path.join(os.path.expanduser('~'), '.8bitcpu', 'shadow')
+
+
+class Shadow(object):
+
+    def __init__(self, port, path=None):
+        if not path:
+            path = os.path.join(SHADOW_DIR, re.sub('[^0-9a-zA-Z]+', '_', port).strip('_') + '.bin')
+        self.path = path
+        self.image = bytearray(MEMORY_SIZE)
+        self.known = bytearray(MEMORY_SIZE)
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        if len(data) != 2 * MEMORY_SIZE:
+            raise Exception(f'Invalid Shadow Image {self.path}')
+        self.image[:] = data[:MEMORY_SIZE]
+        self.known[:] = data[MEMORY_SIZE:]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'wb') as f:
+            f.write(self.image)
+            f.write(self.known)
+
+    def reset(self):
+        self.known[:] = bytes(MEMORY_SIZE)
+
+    def update(self, address, data):
+        address &= MEMORY_SIZE - 1
+        count = min(len(data), MEMORY_SIZE - address)
+        self.image[address:address + count] = data[:count]
+        self.known[address:address + count] = b'\x01' * count
+        if count < len(data):
+            self.update(0, data[count:])
+
+    def unacknowledged(self, address, data):
+        # Returns the (address, length) ranges of data the firmware hasn't acknowledged writing. The board can't read
+        # SRAM back, so this only tells whether every byte was accepted, not what the SRAM holds.
+        return [(a, len(d)) for a, d in self.diff(address, data, gap=0)]
+
+    def diff(self, address, data, gap=DELTA_GAP):
+        # Returns the (address, data) runs that differ from, or are unknown in, the shadow image. Runs separated by
+        # no more than gap matching bytes are merged, as resending those is cheaper than another command and ack.
+        if address < 0 or address + len(data) > MEMORY_SIZE:
+            raise Exception(f'Invalid Range {address:04x}+{len(data):04x}')
+        runs = []
+        start = None
+        end = None
+        for i in range(0, len(data)):
+            if self.known[address + i] and self.image[address + i] == data[i]:
+                continue
+            if start is not None and i - end <= gap:
+                end = i + 1
+                continue
+            if start is not None:
+                runs.append((address + start, bytes(data[start:end])))
+            start, end = i, i + 1
+        if start is not None:
+            runs.append((address + start, bytes(data[start:end])))
+        return runs
 
 
 class Bootstrap(object):
 
-    def __init__(self, port='COM4'):
+    def __init__(self, port='COM4', shadow=None):
+        self.shadow = shadow
         self.serial = serial.Serial(port, 115200)
         print('>>>>> Bootstrap Serial Connected ("', self.serial.readline().decode('ascii').strip(), '")', sep='')
 
@@ -14,6 +98,8 @@ class Bootstrap(object):
 
     def __exit__(self, type, value, traceback):
         self.disable()
+        if self.shadow:
+            self.shadow.save()
 
     def enable(self):
         self.serial.write(b'\x01')
@@ -29,8 +115,78 @@ class Bootstrap(object):
 
     def write(self, address, value):
         self.serial.write(b'\x04' + struct.pack('<HB', address & 0x7fff, value & 0xff))
-        return self.serial.read()[0]
+        echo = self.serial.read()[0]
+        if self.shadow and echo == address & 0xff:
+            self.shadow.update(address, bytes([value & 0xff]))
+        return echo
+
+    def write_block(self, address, data):
+        if len(data) > BLOCK_SIZE:
+            raise Exception(f'Block Too Large {len(data)}')
+        header = struct.pack('<HB', address & 0x7fff, len(data))
+        checksum = sum(header + data) & 0xff
+        self.serial.write(b'\x05' + header + data + bytes([checksum]))
+        if self.serial.read()[0] != checksum:
+            return False
+        if self.shadow:
+            self.shadow.update(address, data)
+        return True
 
     def write_range(self, address, data):
+        for i in range(0, len(data), BLOCK_SIZE):
+            block = bytes(data[i:i + BLOCK_SIZE])
+            for _ in range(0, BLOCK_RETRIES):
+                if self.write_block(address + i, block):
+                    break
+                self.resync()
+            else:
+                raise Exception(f'Block Write Failed At {address + i:04x}')
+
+    def write_range_lockstep(self, address, data):
         for i in range(0, len(data)):
             self.write(address + i, data[i])
+
+    def write_range_pipelined(self, address, data, window=PIPELINE_WINDOW):
+        # Keeps up to window 0x04 commands queued in the firmware's 63 byte receive buffer, checking the echoed
+        # address low bytes in batches, and drops back to lockstep writes from the first unconfirmed byte on mismatch.
+        window = max(1, min(window, PIPELINE_WINDOW))
+        batch = max(1, window // 2)
+        sent = 0
+        acked = 0
+        while acked < len(data):
+            count = min(window - (sent - acked), len(data) - sent)
+            if count > 0:
+                self.serial.write(b''.join([
+                    b'\x04' + struct.pack('<HB', (address + i) & 0x7fff, data[i] & 0xff) for i in range(sent, sent + count)
+                ]))
+                sent += count
+
+            count = min(batch, sent - acked)
+            echoes = self.serial.read(count)
+            expected = bytes([(address + i) & 0xff for i in range(acked, acked + count)])
+            if echoes != expected:
+                for i in range(0, count):
+                    if echoes[i] != expected[i]:
+                        break
+                if self.shadow:
+                    self.shadow.update(address + acked, bytes(data[acked:acked + i]))
+                acked += i
+                self.resync()
+                self.write_range_lockstep(address + acked, data[acked:])
+                return
+            if self.shadow:
+                self.shadow.update(address + acked, bytes(data[acked:acked + count]))
+            acked += count
+
+    def write_delta(self, address, data):
+        if not self.shadow:
+            raise Exception('Delta Write Requires Shadow Image')
+        runs = self.shadow.diff(address, data)
+        for run_address, run_data in runs:
+            self.write_range(run_address, run_data)
+        return runs
+
+    def resync(self):
+        # Let the firmware time out of any partially received command, then drop whatever it echoed meanwhile.
+        time.sleep(RESYNC_DELAY_S)
+        self.serial.reset_input_buffer()
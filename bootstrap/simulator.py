@@ -0,0 +1,173 @@
+import collections
+import os
+import threading
+import time
+
+from bootstrap.bootstrap import RX_BUFFER_SIZE
+from bootstrap.standin import BANNER, BOOT_S, READ_TIMEOUT_S, StandIn
+
+
+# bootstrap.ino constants
+DELAY_US = 50
+DELAY_LONG_MS = 1000
+SETUP_DELAY_MS = 2500
+
+BOOTLOADER_MS = 500
+
+BAUD = 115200
+
+# digitalWrite() on an ATmega328 at 16MHz
+DIGITAL_WRITE_US = 4.0
+
+
+class Timing(object):
+    # Cost model of bootstrap.ino, in microseconds. write_bus() shifts out 16 bits with a DELAY_US per bit, plus one
+    # each for RCLK and enabling the output; each memory strobe adds another. Serial is 8N1, 10 bits per byte.
+
+    def __init__(self, delay_us=DELAY_US, delay_long_ms=DELAY_LONG_MS, digital_write_us=DIGITAL_WRITE_US, baud=BAUD,
+                 bootloader_ms=BOOTLOADER_MS, setup_delay_ms=SETUP_DELAY_MS):
+        self.delay_us = delay_us
+        self.delay_long_ms = delay_long_ms
+        self.digital_write_us = digital_write_us
+        self.baud = baud
+        self.bootloader_ms = bootloader_ms
+        self.setup_delay_ms = setup_delay_ms
+
+    @property
+    def byte_us(self):
+        return 10 * 1000000 / self.baud
+
+    def write_bus_us(self):
+        return 18 * self.delay_us + 52 * self.digital_write_us
+
+    def write_mem_addr_us(self):
+        return self.write_bus_us() + self.delay_us + 5 * self.digital_write_us
+
+    def write_mem_value_us(self):
+        return self.write_bus_us() + self.delay_us + 3 * self.digital_write_us
+
+    def cost_us(self, event):
+        if event == 'write_mem':
+            return self.write_mem_addr_us() + self.write_mem_value_us() + 2 * self.delay_us
+        elif event == 'output_mem':
+            return self.write_mem_addr_us() + self.delay_long_ms * 1000
+        elif event == 'read_timeout':
+            return READ_TIMEOUT_S * 1000000
+        return 0
+
+
+class Simulator(StandIn):
+    # StandIn running on a virtual clock paced against real time: host bytes take byte_us each on the wire into an
+    # RX_BUFFER_SIZE receive buffer (overrunning it drops bytes), firmware operations take their Timing cost, and
+    # replies go back out at the baud rate. scale < 1 runs that many times faster than the hardware would.
+
+    def __init__(self, timing=None, scale=1.0, corrupt=0):
+        super().__init__(corrupt)
+        self.timing = timing or Timing()
+        self.scale = scale
+        self.rx = collections.deque()
+        self.rx_ready = threading.Condition()
+        self.wire = 0.0
+        self.clock = 0.0
+        self.booted = 0.0
+        self.tx = collections.deque()
+        self.tx_ready = threading.Condition()
+        self.tx_clock = 0.0
+        self.overruns = 0
+        self.start_time = None
+        self.receiver = threading.Thread(target=self.receive, daemon=True)
+        self.transmitter = threading.Thread(target=self.transmit, daemon=True)
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self.receiver.start()
+        self.transmitter.start()
+        super().start()
+
+    def stop(self):
+        self.stopping = True
+        with self.rx_ready:
+            self.rx_ready.notify_all()
+        with self.tx_ready:
+            self.tx_ready.notify_all()
+        self.receiver.join()
+        self.transmitter.join()
+        super().stop()
+
+    def now(self):
+        # Virtual time, in microseconds
+        return (time.perf_counter() - self.start_time) * 1000000 / self.scale
+
+    def sleep_until(self, t):
+        delay = (t - self.now()) * self.scale / 1000000
+        if delay > 0:
+            time.sleep(delay)
+
+    def receive(self):
+        # Host bytes are queued with the time each finishes arriving over the wire
+        while not self.stopping:
+            data = self.poll(0.05)
+            self.connection(data)
+            if not data:
+                continue
+            arrived = self.now()
+            with self.rx_ready:
+                for value in data:
+                    self.wire = max(self.wire, arrived) + self.timing.byte_us
+                    self.rx.append((value, self.wire))
+                self.rx_ready.notify_all()
+
+    def reset(self):
+        # The banner follows the bootloader, then setup() waits SETUP_DELAY_MS before loop() reads any command. The
+        # banner never goes out in less than BOOT_S of real time, so the host has finished opening the port.
+        self.enabled = False
+        start = self.now() + max(self.timing.bootloader_ms * 1000, BOOT_S * 1000000 / self.scale)
+        with self.tx_ready:
+            self.tx_clock = start
+            for value in BANNER:
+                self.tx_clock += self.timing.byte_us
+                self.tx.append((value, self.tx_clock))
+            self.tx_ready.notify_all()
+        self.booted = self.tx_clock + self.timing.setup_delay_ms * 1000
+
+    def transmit(self):
+        while True:
+            with self.tx_ready:
+                while not self.tx and not self.stopping:
+                    self.tx_ready.wait()
+                if not self.tx:
+                    return
+                value, t = self.tx.popleft()
+            self.sleep_until(t)
+            try:
+                os.write(self.master, bytes([value]))
+            except OSError:
+                pass
+
+    def next_byte(self, timeout):
+        # Serial.read(), at the later of the firmware being ready and the byte having arrived. Bytes that arrived
+        # while the receive buffer was already full were lost.
+        deadline = time.perf_counter() + timeout * self.scale
+        with self.rx_ready:
+            while not self.rx:
+                remaining = deadline - time.perf_counter()
+                if self.stopping or remaining <= 0:
+                    return None
+                self.rx_ready.wait(remaining)
+            value, arrived = self.rx.popleft()
+            self.clock = max(self.clock, arrived, self.booted)
+            while len(self.rx) > RX_BUFFER_SIZE and self.rx[RX_BUFFER_SIZE][1] <= self.clock:
+                del self.rx[RX_BUFFER_SIZE]
+                self.overruns += 1
+        return value
+
+    def reply(self, value):
+        # Serial.write() returns straight away while there's room in the transmit buffer; the byte reaches the host
+        # once it has been clocked out behind any before it
+        self.tx_clock = max(self.tx_clock, self.clock) + self.timing.byte_us
+        with self.tx_ready:
+            self.tx.append((value & 0xff, self.tx_clock))
+            self.tx_ready.notify_all()
+
+    def elapse(self, event):
+        self.clock += self.timing.cost_us(event)
@@ -0,0 +1,160 @@
+import os
+import pty
+import select
+import struct
+import threading
+import time
+import tty
+
+from bootstrap.bootstrap import BLOCK_SIZE, MEMORY_SIZE
+
+
+BANNER = b'8bitcpu Bootstrap (Stand-In)\r\n'
+
+# Serial.readBytes() gives up on a partial command after its default timeout
+READ_TIMEOUT_S = 1.0
+
+# Opening the port resets the Arduino, whose bootloader runs for a while before the sketch announces itself
+BOOT_S = 0.1
+
+
+class StandIn(object):
+    # Pseudo-terminal stand-in for an Arduino running bootstrap.ino, answering its commands from an in-memory SRAM,
+    # so clients can be tested without hardware. Open .port as the serial port. corrupt garbles the data of that
+    # many 0x05 blocks on arrival, as line noise would, so the checksum fails and the host has to resend;
+    # corrupt_checksum garbles the checksum byte instead.
+
+    def __init__(self, corrupt=0, corrupt_checksum=0):
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        os.close(slave)
+        self.pending = bytearray()
+        self.connected = False
+        self.memory = bytearray(MEMORY_SIZE)
+        self.enabled = False
+        self.corrupt = corrupt
+        self.corrupt_checksum = corrupt_checksum
+        self.commands = {}
+        self.stopping = False
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping = True
+        self.thread.join()
+        os.close(self.master)
+
+    def poll(self, timeout):
+        # Bytes from the host, b'' if none arrive within timeout, or None while no host has the port open (the
+        # master then reads EIO, and selects as readable straight away)
+        if not select.select([self.master], [], [], timeout)[0]:
+            return b''
+        try:
+            return os.read(self.master, 4096)
+        except OSError:
+            time.sleep(min(timeout, 0.01))
+            return None
+
+    def connection(self, data):
+        # Tracks the host opening and closing the port, resetting on each open as the Arduino would
+        if data is None:
+            self.connected = False
+        elif not self.connected:
+            self.connected = True
+            self.reset()
+
+    def reset(self):
+        self.enabled = False
+        time.sleep(BOOT_S)
+        os.write(self.master, BANNER)
+
+    def next_byte(self, timeout):
+        if not self.pending:
+            data = self.poll(timeout)
+            self.connection(data)
+            if not data:
+                return None
+            self.pending += data
+        value = self.pending[0]
+        del self.pending[0]
+        return value
+
+    def read(self, n, timeout=READ_TIMEOUT_S):
+        data = bytearray()
+        while len(data) < n:
+            value = self.next_byte(timeout)
+            if value is None:
+                self.elapse('read_timeout')
+                break
+            data.append(value)
+        # A timed out read leaves the rest of the value zero, as the firmware's would
+        return bytes(data) + bytes(n - len(data))
+
+    def reply(self, value):
+        os.write(self.master, bytes([value & 0xff]))
+
+    def elapse(self, event):
+        # Called for each slow firmware operation ('write_mem', 'output_mem', 'read_timeout'); the stand-in takes no
+        # time over them
+        pass
+
+    def serve(self):
+        while not self.stopping:
+            cmd = self.next_byte(0.05)
+            if cmd is None:
+                continue
+            self.commands[cmd] = self.commands.get(cmd, 0) + 1
+            self.command(cmd)
+
+    def command(self, cmd):
+        if cmd == 0x01:
+            self.enabled = True
+            self.reply(1)
+        elif cmd == 0x02:
+            self.enabled = False
+            self.reply(1)
+        elif cmd == 0x03:
+            address, = struct.unpack('<H', self.read(2))
+            self.elapse('output_mem')
+            self.reply(address)
+        elif cmd == 0x04:
+            address, value = struct.unpack('<HB', self.read(3))
+            self.write_mem(address, value)
+            self.reply(address)
+        elif cmd == 0x05:
+            self.reply(self.write_mem_block())
+
+    def write_mem(self, address, value):
+        # With the memory control pins released (disabled) writes never reach the SRAM
+        self.elapse('write_mem')
+        if self.enabled:
+            self.memory[address & (MEMORY_SIZE - 1)] = value
+
+    def write_mem_block(self):
+        header = self.read(3)
+        address, length = struct.unpack('<HB', header)
+        block = bytearray(self.read(length))
+        checksum = self.read(1)[0]
+        if self.corrupt and length:
+            self.corrupt -= 1
+            block[0] ^= 0xff
+        elif self.corrupt_checksum:
+            self.corrupt_checksum -= 1
+            checksum ^= 0xff
+        total = sum(header + block) & 0xff
+        if length <= BLOCK_SIZE and total == checksum:
+            for i in range(0, length):
+                self.write_mem(address + i, block[i])
+            return checksum
+        reply = ~checksum & 0xff
+        return reply ^ 1 if reply == total else reply
@@ -0,0 +1,3 @@
+from cpuemu.cpuemu import *
+from cpuemu.fast import *
+from cpuemu.jit import *
\ No newline at end of file
@@ -0,0 +1,54 @@
+import argparse
+import os
+import time
+
+import cpuemu
+from cpuemu.symbols import Symbols
+from eeproms import control
+
+
+def run(args):
+    with open(args.file, 'rb') as f:
+        image = f.read()
+    symbols = Symbols.load(args.symbols) if args.symbols else Symbols.find(args.file)
+    control.EARLY_RESET = args.early_reset
+
+    if args.mode == 'jit':
+        m = cpuemu.JitMachine(image)
+    elif args.mode == 'fast' or args.check:
+        m = cpuemu.FastMachine(image)
+    else:
+        m = cpuemu.Machine(image)
+
+    start = time.perf_counter()
+    if args.check:
+        m.run(args.cycles, check=True)
+    else:
+        m.run(args.cycles)
+    elapsed = time.perf_counter() - start
+
+    print()
+    print(m.status())
+    if len(symbols):
+        print(f'            [@ ]: {symbols.lookup(m.seg << 8 | m.pc)}')
+    print()
+    print('Outputs:', ' '.join([str(o) for o in m.outputs[-args.outputs:]]) if args.outputs else len(m.outputs))
+    print(f'{m.cycles} Microsteps In {elapsed:.3f}s ({m.cycles / max(elapsed, 1e-9):,.0f}/s)')
+    print()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='8bitcpu Emulator.')
+    parser.add_argument('--check', dest='check', action='store_true')
+    parser.add_argument('--cycles', dest='cycles', default=1000000, type=int)
+    parser.add_argument('--mode', dest='mode', default='micro', choices=['micro', 'fast', 'jit'])
+    parser.add_argument('--no-early-reset', dest='early_reset', action='store_false')
+    parser.add_argument('--outputs', dest='outputs', default=32, type=int)
+    parser.add_argument('--symbols', dest='symbols', default='', type=str)
+    parser.add_argument('file', type=str)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file):
+        raise Exception(f'Cannot Find File {args.file}')
+
+    run(args)
@@ -0,0 +1,119 @@
+import numpy as np
+
+from cpuemu import microcode
+from cpuemu.cpuemu import MEMORY_SIZE, REGISTERS
+
+
+class BatchMachine(object):
+    # N machines held as NumPy arrays and advanced in lockstep, one microstep at a time for all of them, from the
+    # same control word table as Machine. Halted machines (and any outside the current mask) are left untouched.
+
+    def __init__(self, images, n=None):
+        if isinstance(images, (bytes, bytearray)):
+            images = [images] * (n or 1)
+        self.n = len(images)
+        self.rows = np.arange(self.n)
+        words = microcode.control_words()
+        self.words = np.array(words, dtype=np.int64)
+        self.resets = np.frombuffer(microcode.resets(words), dtype=np.uint8).astype(bool)
+
+        self.memory = np.zeros((self.n, MEMORY_SIZE), dtype=np.uint8)
+        for i, image in enumerate(images):
+            image = image[:MEMORY_SIZE]
+            self.memory[i, :len(image)] = np.frombuffer(bytes(image), dtype=np.uint8)
+
+        for r in REGISTERS + ('cycles', 'instructions'):
+            setattr(self, r, np.zeros(self.n, dtype=np.int64))
+        self.halted = np.zeros(self.n, dtype=bool)
+        self.outputs = [[] for _ in range(0, self.n)]
+
+    def state(self, i):
+        return tuple([int(getattr(self, r)[i]) for r in REGISTERS[:-1]]) + (bool(self.halted[i]),) + \
+            (int(self.cycles[i]), int(self.instructions[i]))
+
+    def microstep(self, mask=None):
+        active = ~self.halted if mask is None else mask & ~self.halted
+        w = np.where(active, self.words[(self.flags << 11) | (self.ir << 3) | self.step], 0)
+        present = int(np.bitwise_or.reduce(w)) if self.n else 0
+
+        a, b = self.a, self.b
+        on = lambda line: (w & line) != 0
+
+        bus = np.zeros(self.n, dtype=np.int64)
+        if present & microcode.PCOUT:
+            bus |= np.where(on(microcode.PCOUT), self.seg << 8 | self.pc, 0)
+        if present & microcode.MOUT:
+            bus |= np.where(on(microcode.MOUT), self.memory[self.rows, self.mar], 0)
+        for line, r in ((microcode.IOUT, self.il), (microcode.AOUT, a), (microcode.BOUT, b),
+                        (microcode.COUT, self.c), (microcode.DOUT, self.d)):
+            if present & line:
+                bus |= np.where(on(line), r, 0)
+        if present & microcode.SOUT:
+            bus |= np.where(on(microcode.SOUT), np.where(on(microcode.SNEG), a - b, a + b) & 0xff, 0)
+
+        if present & microcode.FLIN:
+            s = np.where(on(microcode.SNEG), a + (b ^ 0xff) + 1, a + b)
+            self.flags = np.where(on(microcode.FLIN), (s >> 8) | (((s & 0xff) == 0) << 1), self.flags)
+        if present & microcode.AIN:
+            self.a = np.where(on(microcode.AIN), bus & 0xff, a)
+        if present & microcode.BIN:
+            self.b = np.where(on(microcode.BIN), bus & 0xff, b)
+        if present & microcode.CIN:
+            self.c = np.where(on(microcode.CIN), bus, self.c)
+        if present & (microcode.DLIN | microcode.DHIN):
+            dl, dh = on(microcode.DLIN), on(microcode.DHIN)
+            d = self.d
+            d = np.where(dl & ~dh, d & 0xff00 | bus & 0xff, d)
+            d = np.where(dh & ~dl, (bus & 0xff) << 8 | d & 0xff, d)
+            self.d = np.where(dl & dh, bus, d)
+        if present & microcode.OIN:
+            sel = on(microcode.OIN)
+            self.o = np.where(sel, self.d & 0xff, self.o)
+            for i in np.nonzero(sel)[0]:
+                self.outputs[i].append(int(self.o[i]))
+        if present & microcode.ILIN:
+            self.il = np.where(on(microcode.ILIN), bus & 0xff, self.il)
+        if present & microcode.IHIN:
+            self.ir = np.where(on(microcode.IHIN), bus & 0xff, self.ir)
+        if present & microcode.MIN:
+            rows = np.nonzero(on(microcode.MIN))[0]
+            self.memory[rows, self.mar[rows]] = bus[rows] & 0xff
+        if present & microcode.MAIN:
+            self.mar = np.where(on(microcode.MAIN), bus & 0x7fff, self.mar)
+        if present & (microcode.PCLD | microcode.SGIN):
+            pcld, sgin = on(microcode.PCLD), on(microcode.SGIN)
+            self.pc = np.where(pcld, bus & 0xff, self.pc)
+            self.seg = np.where(sgin, np.where(pcld, bus >> 8 & 0xff, bus & 0xff), self.seg)
+        if present & microcode.PCEN:
+            self.pc = np.where(on(microcode.PCEN), (self.pc + 1) & 0xff, self.pc)
+        if present & microcode.HALT:
+            self.halted |= on(microcode.HALT)
+
+        self.instructions += active & (self.step == 0)
+        self.cycles += active
+        # SRST is decoded from the IR and flags just latched, clearing the counter before the step it is in runs
+        step = (self.step + 1) % microcode.STEPS
+        step = np.where(self.resets[(self.flags << 11) | (self.ir << 3) | step], 0, step)
+        self.step = np.where(active, step, self.step)
+        return active
+
+    def instruction(self, mask=None):
+        # Machines that finish their instruction early wait, masked out, for the rest of the batch.
+        active = self.microstep(mask)
+        while True:
+            active &= (self.step != 0) & ~self.halted
+            if not active.any():
+                break
+            self.microstep(active)
+
+    def running(self):
+        return ~self.halted
+
+    def run(self, max_cycles=1000000):
+        limit = self.cycles + max_cycles
+        while True:
+            mask = ~self.halted & (self.cycles < limit)
+            if not mask.any():
+                break
+            self.microstep(mask)
+        return self.cycles
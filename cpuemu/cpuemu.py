@@ -0,0 +1,82 @@
+from cpuemu import microcode
+
+
+MEMORY_SIZE = 0x8000
+
+REGISTERS = ('a', 'b', 'c', 'd', 'seg', 'pc', 'ir', 'il', 'mar', 'o', 'flags', 'step', 'halted')
+
+_TABLES = {}
+
+
+def compile_table():
+    # One function per (control word, step, next step) triple, laid out flat by control EEPROM address, so each
+    # microstep is a single list index and call. Entries asserting SRST are never reached: the step before them
+    # moves straight on to step 0.
+    words = microcode.control_words()
+    resets = microcode.resets(words)
+    compiled = {}
+    table = []
+    for i, word in enumerate(words):
+        step = i & (microcode.STEPS - 1)
+        next_step = microcode.next_step_statement(words, i, 'm.{}')
+        key = (word, step, next_step)
+        if key not in compiled:
+            name = f'uop_{word:06x}_{step}'
+            lines = microcode.statements(word, 'm.{}')
+            lines.append(next_step)
+            lines.append('m.cycles += 1')
+            if step == 0:
+                lines.append('m.instructions += 1')
+            namespace = {'RESETS': resets}
+            exec(f'def {name}(m):\n' + ''.join([f'    {l}\n' for l in lines]), namespace)
+            compiled[key] = namespace[name]
+        table.append(compiled[key])
+    return table
+
+
+def table():
+    # Compiled once for each setting of control.EARLY_RESET
+    key = microcode.early_reset()
+    if key not in _TABLES:
+        _TABLES[key] = compile_table()
+    return _TABLES[key]
+
+
+class Machine(object):
+    __slots__ = REGISTERS + ('memory', 'cycles', 'instructions', 'outputs', 'table')
+
+    def __init__(self, image=b''):
+        self.memory = bytearray(MEMORY_SIZE)
+        self.memory[:min(len(image), MEMORY_SIZE)] = image[:MEMORY_SIZE]
+        self.table = table()
+        self.reset()
+
+    def reset(self):
+        for r in REGISTERS:
+            setattr(self, r, 0)
+        self.halted = False
+        self.cycles = 0
+        self.instructions = 0
+        self.outputs = []
+
+    def state(self):
+        return tuple([getattr(self, r) for r in REGISTERS]) + (self.cycles, self.instructions)
+
+    def microstep(self):
+        self.table[(self.flags << 11) | (self.ir << 3) | self.step](self)
+
+    def run(self, max_cycles=1000000):
+        table = self.table
+        limit = self.cycles + max_cycles
+        while not self.halted and self.cycles < limit:
+            table[(self.flags << 11) | (self.ir << 3) | self.step](self)
+        return self.cycles
+
+    def status(self):
+        return (
+            f'[{self.instructions:08x}]  [P ]: {self.seg:02x}:{self.pc:02x}  [I ]: {self.ir:02x}  '
+            f'[FC]: {self.flags & microcode.FLAG_C}  [FZ]: {(self.flags & microcode.FLAG_Z) >> 1}  '
+            f'[H ]: {int(self.halted)}\n'
+            f'            [RA]: {self.a:02x}  [RB]: {self.b:02x}  [RC]: {self.c:04x}  [RD]: {self.d:04x}  '
+            f'[RO]: {self.o:02x} ({self.o:3})  [T ]: {self.cycles}'
+        )
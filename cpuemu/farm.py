@@ -0,0 +1,116 @@
+import argparse
+import concurrent.futures
+import glob
+import json
+import os
+import sys
+import time
+
+import assembler
+import cpuemu
+from eeproms import control
+
+
+DEFAULT_CYCLES = 100000
+
+MACHINES = {
+    'micro': cpuemu.Machine,
+    'fast': cpuemu.FastMachine,
+    'jit': cpuemu.JitMachine,
+}
+
+RESULTS = ('outputs', 'halted', 'cycles', 'instructions')
+
+
+def default_case():
+    return {'name': 'default', 'cycles': DEFAULT_CYCLES, 'memory': {}, 'registers': {}}
+
+
+def golden_path(golden_dir, source_file):
+    return os.path.join(golden_dir, os.path.splitext(os.path.basename(source_file))[0] + '.json')
+
+
+def load_cases(path):
+    # A golden file is a list of cases, each giving the initial memory (address -> byte) and registers to run from,
+    # the cycle budget, and the expected results (absent until recorded with --update).
+    if not os.path.exists(path):
+        return [default_case()]
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def run_case(mode, image, case, early_reset=True):
+    control.EARLY_RESET = early_reset
+    m = MACHINES[mode](image)
+    for address, value in case.get('memory', {}).items():
+        m.memory[int(address, 0) & 0x7fff] = value & 0xff
+    for r, value in case.get('registers', {}).items():
+        setattr(m, r, value)
+    m.run(case.get('cycles', DEFAULT_CYCLES))
+    return {'outputs': m.outputs, 'halted': m.halted, 'cycles': m.cycles, 'instructions': m.instructions}
+
+
+def compare(case, result):
+    expected = case.get('expected')
+    if expected is None:
+        return ['No Golden Result']
+    return [f'{k}: expected {expected.get(k)} got {result[k]}' for k in RESULTS if expected.get(k) != result[k]]
+
+
+def run(args):
+    sources = sorted(glob.glob(os.path.join(args.dir, '*.8a')))
+    # Cycle counts depend on the step counter resetting early, so each setting has its own golden results
+    golden_dir = args.golden or os.path.join(args.dir, 'golden' if args.early_reset else 'golden-no-early-reset')
+
+    start = time.perf_counter()
+    programs = {}
+    for source_file in sources:
+        _, _, machine_code, _ = assembler.build(source_file)
+        programs[source_file] = (machine_code, load_cases(golden_path(golden_dir, source_file)))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs or None) as executor:
+        futures = {}
+        for source_file, (machine_code, cases) in programs.items():
+            for i, case in enumerate(cases):
+                futures[(source_file, i)] = executor.submit(run_case, args.mode, machine_code, case, args.early_reset)
+        results = {k: f.result() for k, f in futures.items()}
+
+    failures = 0
+    for source_file, (machine_code, cases) in programs.items():
+        name = os.path.basename(source_file)
+        for i, case in enumerate(cases):
+            result = results[(source_file, i)]
+            if args.update:
+                case['expected'] = result
+                continue
+            errors = compare(case, result)
+            failures += len(errors) > 0
+            print(f'{"FAIL" if errors else "PASS"}  {name} [{case.get("name", i)}]  '
+                  f'{result["cycles"]} Cycles  {len(result["outputs"])} Outputs')
+            for e in errors:
+                print(f'    {e}')
+        if args.update:
+            os.makedirs(golden_dir, exist_ok=True)
+            with open(golden_path(golden_dir, source_file), 'w') as f:
+                json.dump(cases, f, indent=2)
+            print(f'UPDATED  {name}  {len(cases)} Cases')
+
+    print()
+    print(f'{len(results)} Cases, {failures} Failed, In {time.perf_counter() - start:.2f}s')
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Emulator Program Test Farm.')
+    parser.add_argument('--golden', dest='golden', default='', type=str)
+    parser.add_argument('--jobs', dest='jobs', default=0, type=int)
+    parser.add_argument('--mode', dest='mode', default='jit', choices=list(MACHINES.keys()))
+    parser.add_argument('--no-early-reset', dest='early_reset', action='store_false')
+    parser.add_argument('--update', dest='update', action='store_true')
+    parser.add_argument('dir', type=str)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.dir):
+        raise Exception(f'Cannot Find Directory {args.dir}')
+
+    sys.exit(1 if run(args) else 0)
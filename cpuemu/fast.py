@@ -0,0 +1,112 @@
+from cpuemu import microcode
+from cpuemu.cpuemu import REGISTERS, Machine, table
+
+
+FETCH = (microcode.PCOUT | microcode.MAIN, microcode.MOUT | microcode.IHIN | microcode.PCEN)
+
+_INSTRUCTIONS = {}
+
+
+def compile_instruction(words, flags, opcode):
+    # Straight-line code for every microstep of one instruction. Flags only select the control words, so after a
+    # FLIN step the rest of the instruction stays straight-line as long as it is the same under every flag value,
+    # otherwise it finishes through the microstep table. It ends early at a step asserting SRST.
+    lines = []
+    count = 0
+    for step in range(0, microcode.STEPS):
+        word = words[microcode.index(flags, opcode, step)]
+        if word & microcode.SRST:
+            break
+        lines += microcode.statements(word, 'm.{}')
+        count += 1
+        if word & microcode.HALT:
+            lines.append(microcode.next_step_statement(words, microcode.index(flags, opcode, step), 'm.{}'))
+            break
+        if word & microcode.FLIN and step + 1 < microcode.STEPS:
+            rest = [
+                [words[microcode.index(f, opcode, s)] for s in range(step + 1, microcode.STEPS)] for f in range(0, 4)
+            ]
+            if any([r != rest[0] for r in rest]):
+                lines.append(microcode.next_step_statement(words, microcode.index(flags, opcode, step), 'm.{}'))
+                lines.append(f'm.cycles += {count}')
+                lines.append('m.instructions += 1')
+                lines.append('while m.step and not m.halted:')
+                lines.append('    table[(m.flags << 11) | (m.ir << 3) | m.step](m)')
+                return lines
+    lines.append(f'm.cycles += {count}')
+    lines.append('m.instructions += 1')
+    return lines
+
+
+def compile_instructions():
+    words = microcode.control_words()
+    for i in range(0, len(words), microcode.STEPS):
+        if tuple(words[i:i + 2]) != FETCH:
+            raise Exception(f'Fast Mode Requires Common Fetch Microsteps {i:04x}')
+
+    namespace = {'table': table(), 'RESETS': microcode.resets(words)}
+    compiled = {}
+    instructions = []
+    for flags in range(0, 4):
+        for opcode in range(0, 0x100):
+            lines = compile_instruction(words, flags, opcode)
+            key = tuple(lines)
+            if key not in compiled:
+                name = f'instr_{flags:x}_{opcode:02x}'
+                exec(f'def {name}(m):\n' + ''.join([f'    {l}\n' for l in lines]), namespace)
+                compiled[key] = namespace[name]
+            instructions.append(compiled[key])
+    return instructions
+
+
+def instructions():
+    # Compiled once for each setting of control.EARLY_RESET
+    key = microcode.early_reset()
+    if key not in _INSTRUCTIONS:
+        _INSTRUCTIONS[key] = compile_instructions()
+    return _INSTRUCTIONS[key]
+
+
+class FastMachine(Machine):
+    __slots__ = ('instrs',)
+
+    def __init__(self, image=b''):
+        super().__init__(image)
+        self.instrs = instructions()
+
+    def instruction(self):
+        while self.step and not self.halted:
+            self.microstep()
+        if not self.halted:
+            self.instrs[(self.flags << 8) | self.memory[(self.seg << 8 | self.pc) & 0x7fff]](self)
+
+    def run(self, max_cycles=1000000, check=False):
+        if check:
+            return self.run_checked(max_cycles)
+        instrs = self.instrs
+        memory = self.memory
+        limit = self.cycles + max_cycles
+        while self.step and not self.halted:
+            self.microstep()
+        while not self.halted and self.cycles < limit - microcode.STEPS:
+            instrs[(self.flags << 8) | memory[(self.seg << 8 | self.pc) & 0x7fff]](self)
+        # Finish by microstep so the run stops on exactly the same cycle as Machine.run
+        return Machine.run(self, limit - self.cycles)
+
+    def run_checked(self, max_cycles=1000000):
+        # Runs a microstep Machine in lockstep, one instruction at a time, and compares the full state after each.
+        reference = Machine(self.memory)
+        for r in REGISTERS + ('cycles', 'instructions'):
+            setattr(reference, r, getattr(self, r))
+        reference.outputs = list(self.outputs)
+
+        limit = self.cycles + max_cycles
+        while not self.halted and self.cycles < limit:
+            self.instruction()
+            reference.microstep()
+            while reference.step and not reference.halted:
+                reference.microstep()
+            if self.state() != reference.state() or self.memory != reference.memory or \
+                    self.outputs[-1:] != reference.outputs[-1:]:
+                raise Exception(f'Fast Mode Mismatch\n{self.status()}\n{reference.status()}')
+        return self.cycles
@@ -0,0 +1,311 @@
+from cpuemu import microcode
+from cpuemu.cpuemu import MEMORY_SIZE, REGISTERS, Machine
+
+
+# JMP*, JC, JZ and HALT end a basic block
+TERMINATORS = frozenset([0x01] + list(range(0x44, 0x4e)))
+
+MAX_BLOCK = 64
+MAX_RETIRED = 16
+
+STATE = ('a', 'b', 'c', 'd', 'seg', 'pc', 'ir', 'il', 'mar', 'o', 'flags')
+
+
+class Block(object):
+    __slots__ = ('fn', 'code', 'values', 'source')
+
+    def __init__(self, fn, code, values, source):
+        self.fn = fn
+        self.code = code
+        self.values = values
+        self.source = source
+
+
+class Translator(object):
+    # Emits Python source for a basic block, folding everything known at translation time: the segment and PC of
+    # each instruction, and the code bytes it fetches (which invalidate the block if stored to). Registers hold
+    # either an int, when known, or the name of the local holding their value.
+
+    def __init__(self, memory, words, seg, pc):
+        self.memory = memory
+        self.words = words
+        self.vals = {r: r for r in STATE}
+        self.vals['seg'] = seg
+        self.vals['pc'] = pc
+        self.modified = set()
+        self.code = set()
+        self.mar_code = False
+        self.halted = False
+        self.flag_set = (0, 1, 2, 3)
+        self.stores = []
+        self.cycles = 0
+        self.instructions = 0
+        self.lines = []
+        self.indent = 1
+
+    def fork(self):
+        t = Translator.__new__(Translator)
+        t.__dict__.update(self.__dict__)
+        t.vals = dict(self.vals)
+        t.modified = set(self.modified)
+        t.stores = list(self.stores)
+        return t
+
+    def emit(self, line):
+        self.lines.append('    ' * self.indent + line)
+
+    def set(self, r, value):
+        self.modified.add(r)
+        if type(value) == int:
+            self.vals[r] = value
+        else:
+            self.emit(f'{r} = {value}')
+            self.vals[r] = r
+
+    def exit(self, step=0):
+        for r in STATE:
+            if r in self.modified:
+                self.emit(f'm.{r} = {self.vals[r]}')
+        if step:
+            self.emit(f'm.step = {step}')
+        if self.halted:
+            self.emit('m.halted = True')
+        self.emit(f'm.cycles += {self.cycles}')
+        self.emit(f'm.instructions += {self.instructions}')
+
+    def microstep(self, word):
+        v = self.vals
+        known = lambda *rs: all([type(v[r]) == int for r in rs])
+
+        if word & microcode.BUS_IN:
+            consts = 0
+            exprs = []
+            code_fetch = (word & microcode.BUS_OUT) == microcode.PCOUT and known('seg', 'pc')
+            if word & microcode.PCOUT:
+                if known('seg', 'pc'):
+                    consts |= v['seg'] << 8 | v['pc']
+                else:
+                    exprs.append(f'({v["seg"]} << 8 | {v["pc"]})')
+            if word & microcode.MOUT:
+                if known('mar') and self.mar_code:
+                    self.code.add(v['mar'])
+                    consts |= self.memory[v['mar']]
+                else:
+                    exprs.append(f'mem[{v["mar"]}]')
+            for line, r in ((microcode.IOUT, 'il'), (microcode.AOUT, 'a'), (microcode.BOUT, 'b'),
+                            (microcode.COUT, 'c'), (microcode.DOUT, 'd')):
+                if word & line:
+                    if known(r):
+                        consts |= v[r]
+                    else:
+                        exprs.append(v[r])
+            if word & microcode.SOUT:
+                if known('a', 'b'):
+                    consts |= (v['a'] - v['b'] if word & microcode.SNEG else v['a'] + v['b']) & 0xff
+                else:
+                    op = '-' if word & microcode.SNEG else '+'
+                    exprs.append(f'(({v["a"]} {op} {v["b"]}) & 0xff)')
+            if exprs:
+                if consts:
+                    exprs.append(str(consts))
+                self.emit(f'bus = {" | ".join(exprs)}')
+                bus = 'bus'
+            else:
+                bus = consts
+
+        if word & microcode.FLIN:
+            self.flag_set = (0, 1, 2, 3)
+            if known('a', 'b'):
+                s = v['a'] + (v['b'] ^ 0xff) + 1 if word & microcode.SNEG else v['a'] + v['b']
+                self.set('flags', (s >> 8) | (((s & 0xff) == 0) << 1))
+            else:
+                s = f'{v["a"]} + ({v["b"]} ^ 0xff) + 1' if word & microcode.SNEG else f'{v["a"]} + {v["b"]}'
+                self.emit(f's = {s}')
+                self.set('flags', '(s >> 8) | (((s & 0xff) == 0) << 1)')
+
+        latch = lambda r, f, e: self.set(r, f(bus) if type(bus) == int else e)
+
+        if word & microcode.AIN:
+            latch('a', lambda x: x & 0xff, 'bus & 0xff')
+        if word & microcode.BIN:
+            latch('b', lambda x: x & 0xff, 'bus & 0xff')
+        if word & microcode.CIN:
+            latch('c', lambda x: x, 'bus')
+        if word & microcode.DLIN and word & microcode.DHIN:
+            latch('d', lambda x: x, 'bus')
+        elif word & (microcode.DLIN | microcode.DHIN):
+            d = v['d']
+            if word & microcode.DLIN:
+                value = (d & 0xff00 | bus & 0xff) if known('d') and type(bus) == int else f'{d} & 0xff00 | {bus} & 0xff'
+            else:
+                value = ((bus & 0xff) << 8 | d & 0xff) if known('d') and type(bus) == int else \
+                    f'({bus} & 0xff) << 8 | {d} & 0xff'
+            self.set('d', value)
+        if word & microcode.OIN:
+            self.set('o', v['d'] & 0xff if known('d') else f'{v["d"]} & 0xff')
+            self.emit(f'outputs.append({v["o"]})')
+        if word & microcode.ILIN:
+            latch('il', lambda x: x & 0xff, 'bus & 0xff')
+        if word & microcode.IHIN:
+            latch('ir', lambda x: x & 0xff, 'bus & 0xff')
+        if word & microcode.MIN:
+            st = f'st{len(self.stores)}'
+            self.emit(f'{st} = {v["mar"]}')
+            self.emit(f'mem[{st}] = {bus if type(bus) == int else "bus"} & 0xff')
+            self.stores.append(st)
+        if word & microcode.MAIN:
+            latch('mar', lambda x: x & 0x7fff, 'bus & 0x7fff')
+            self.mar_code = code_fetch
+        if word & microcode.PCLD and word & microcode.SGIN:
+            latch('pc', lambda x: x & 0xff, 'bus & 0xff')
+            latch('seg', lambda x: x >> 8 & 0xff, 'bus >> 8 & 0xff')
+        elif word & microcode.PCLD:
+            latch('pc', lambda x: x & 0xff, 'bus & 0xff')
+        elif word & microcode.SGIN:
+            latch('seg', lambda x: x & 0xff, 'bus & 0xff')
+        if word & microcode.PCEN:
+            self.set('pc', (v['pc'] + 1) & 0xff if known('pc') else f'({v["pc"]} + 1) & 0xff')
+        if word & microcode.HALT:
+            self.halted = True
+
+    def instruction(self, opcode, start=0):
+        # Returns False once the block has had to end part way through, having already emitted its exits.
+        if start == 0:
+            self.instructions += 1
+        for step in range(start, microcode.STEPS):
+            flags = self.vals['flags']
+            if type(flags) == int:
+                word = self.words[microcode.index(flags, opcode, step)]
+            else:
+                variants = {}
+                for f in self.flag_set:
+                    variants.setdefault(self.words[microcode.index(f, opcode, step)], []).append(f)
+                if len(variants) > 1:
+                    for i, fs in enumerate(variants.values()):
+                        test = f'{flags} == {fs[0]}' if len(fs) == 1 else f'{flags} in {tuple(fs)}'
+                        self.emit(f'{"if" if i == 0 else "elif"} {test}:')
+                        t = self.fork()
+                        t.indent += 1
+                        t.flag_set = fs
+                        if t.instruction(opcode, step):
+                            t.exit()
+                            t.emit('return')
+                    return False
+                word = self.words[microcode.index(self.flag_set[0], opcode, step)]
+            if word & microcode.SRST:
+                break
+            self.cycles += 1
+            self.microstep(word)
+            if self.halted:
+                self.exit(microcode.next_step(self.words, microcode.index(self.flag_set[0], opcode, step)) or 0)
+                self.emit('return')
+                return False
+        if self.stores:
+            self.emit(f'if {" or ".join([f"code[{st}]" for st in self.stores])}:')
+            self.indent += 1
+            self.exit()
+            for st in self.stores:
+                self.emit(f'm.invalidate({st})')
+            self.emit('return')
+            self.indent -= 1
+            self.stores = []
+        return True
+
+
+class JitMachine(Machine):
+    __slots__ = ('blocks', 'retired', 'code', 'words')
+
+    def __init__(self, image=b''):
+        super().__init__(image)
+        self.blocks = {}
+        self.retired = {}
+        self.code = bytearray(MEMORY_SIZE)
+        self.words = microcode.control_words()
+
+    def translate(self, key):
+        # Self-modifying programs (e.g. tables.8a patching an operand) tend to cycle through a few variants of the
+        # same block, so invalidated blocks are kept and reused while their code bytes match memory again.
+        for block in self.retired.get(key, []):
+            if bytes([self.memory[a] for a in block.code]) == block.values:
+                return self.install(key, block)
+
+        t = Translator(self.memory, self.words, key >> 8, key & 0xff)
+        for _ in range(0, MAX_BLOCK):
+            opcode = self.memory[(t.vals['seg'] << 8 | t.vals['pc']) & 0x7fff]
+            if not t.instruction(opcode):
+                break
+            if opcode in TERMINATORS or type(t.vals['seg']) != int or type(t.vals['pc']) != int:
+                t.exit()
+                break
+        else:
+            t.exit()
+
+        lines = [f'def block_{key:04x}(m):', '    mem = m.memory', '    code = m.code', '    outputs = m.outputs']
+        lines += [f'    {r} = m.{r}' for r in STATE]
+        source = '\n'.join(lines + t.lines) + '\n'
+        namespace = {}
+        exec(source, namespace)
+
+        code = sorted(t.code)
+        block = Block(namespace[f'block_{key:04x}'], code, bytes([self.memory[a] for a in code]), source)
+        return self.install(key, block)
+
+    def install(self, key, block):
+        self.blocks[key] = block
+        for address in block.code:
+            self.code[address] += 1
+        return block
+
+    def invalidate(self, address):
+        for key, block in list(self.blocks.items()):
+            if address in block.code:
+                del self.blocks[key]
+                for a in block.code:
+                    self.code[a] -= 1
+                retired = self.retired.setdefault(key, [])
+                retired.append(block)
+                del retired[:-MAX_RETIRED]
+
+    def block(self):
+        while self.step and not self.halted:
+            self.microstep()
+        if self.halted:
+            return
+        key = self.seg << 8 | self.pc
+        block = self.blocks.get(key)
+        if block is None:
+            block = self.translate(key)
+        block.fn(self)
+
+    def run(self, max_cycles=1000000, check=False):
+        if check:
+            return self.run_checked(max_cycles)
+        blocks = self.blocks
+        limit = self.cycles + max_cycles
+        while self.step and not self.halted:
+            self.microstep()
+        while not self.halted and self.cycles < limit - MAX_BLOCK * microcode.STEPS:
+            key = self.seg << 8 | self.pc
+            block = blocks.get(key)
+            if block is None:
+                block = self.translate(key)
+            block.fn(self)
+        # Finish by microstep so the run stops on exactly the same cycle as Machine.run
+        return Machine.run(self, limit - self.cycles)
+
+    def run_checked(self, max_cycles=1000000):
+        # Runs a microstep Machine alongside, comparing the full state at the end of every block.
+        reference = Machine(self.memory)
+        for r in REGISTERS + ('cycles', 'instructions'):
+            setattr(reference, r, getattr(self, r))
+        reference.outputs = list(self.outputs)
+
+        limit = self.cycles + max_cycles
+        while not self.halted and self.cycles < limit:
+            self.block()
+            while not reference.halted and (reference.instructions < self.instructions or reference.step):
+                reference.microstep()
+            if self.state() != reference.state() or self.memory != reference.memory or \
+                    self.outputs[-1:] != reference.outputs[-1:]:
+                raise Exception(f'JIT Mismatch\n{self.status()}\n{reference.status()}')
+        return self.cycles
@@ -0,0 +1,156 @@
+from eeproms import control
+
+
+FLAG_C = 0x1
+FLAG_Z = 0x2
+
+STEPS = control.STEPS
+TABLE_SIZE = control.IMAGE_SIZE
+
+
+def line(control_line):
+    eeprom, bit = control_line
+    return 1 << (eeprom * 8 + bit)
+
+
+HALT  = line(control.HALT)
+AIN   = line(control.AIN)
+AOUT  = line(control.AOUT)
+BIN   = line(control.BIN)
+BOUT  = line(control.BOUT)
+SOUT  = line(control.SOUT)
+SNEG  = line(control.SNEG)
+CIN   = line(control.CIN)
+COUT  = line(control.COUT)
+DLIN  = line(control.DLIN)
+DHIN  = line(control.DHIN)
+DOUT  = line(control.DOUT)
+OIN   = line(control.OIN)
+ILIN  = line(control.ILIN)
+IHIN  = line(control.IHIN)
+IOUT  = line(control.IOUT)
+PCEN  = line(control.PCEN)
+PCLD  = line(control.PCLD)
+PCOUT = line(control.PCOUT)
+MAIN  = line(control.MAIN)
+MIN   = line(control.MIN)
+MOUT  = line(control.MOUT)
+FLIN  = line(control.FLIN)
+SGIN  = line(control.SGIN)
+SRST  = line(control.SRST)
+
+BUS_OUT = PCOUT | MOUT | IOUT | AOUT | BOUT | COUT | DOUT | SOUT
+BUS_IN = AIN | BIN | CIN | DLIN | DHIN | ILIN | IHIN | MAIN | MIN | PCLD | SGIN
+
+
+def index(flags, opcode, step):
+    # Same layout as the control EEPROM address lines: [ ZF CF | opcode | step ]
+    return (flags << 11) | (opcode << 3) | step
+
+
+def instructions(flags):
+    return control.instructions(flags)
+
+
+def early_reset():
+    return control.EARLY_RESET
+
+
+def control_words():
+    # Follows control.EARLY_RESET, as the images do
+    return control.words()
+
+
+def resets(words):
+    # 1 for each table entry asserting SRST. The counter clears as soon as such a step begins, so it never runs:
+    # the step before it is followed by step 0.
+    return bytes([1 if word & SRST else 0 for word in words])
+
+
+def next_step(words, i):
+    # The step following table entry i, or None when it depends on the IR or flags the entry itself latches
+    step = i & (STEPS - 1)
+    if step + 1 == STEPS:
+        return 0
+    elif words[i] & (IHIN | FLIN):
+        return None
+    return 0 if words[i + 1] & SRST else step + 1
+
+
+def next_step_statement(words, i, r):
+    step = next_step(words, i)
+    if step is None:
+        nxt = (i & (STEPS - 1)) + 1
+        return f'{r.format("step")} = 0 if RESETS[({r.format("flags")} << 11) | ({r.format("ir")} << 3) | {nxt}] else {nxt}'
+    return f'{r.format("step")} = {step}'
+
+
+def bus_source(word, r):
+    # Drivers onto the bus for a control word, with register reads formatted through r (e.g. 'm.{}').
+    a, b = r.format('a'), r.format('b')
+    sources = []
+    if word & PCOUT:
+        sources.append(f'({r.format("seg")} << 8 | {r.format("pc")})')
+    if word & MOUT:
+        sources.append(f'{r.format("memory")}[{r.format("mar")}]')
+    if word & IOUT:
+        sources.append(r.format('il'))
+    if word & AOUT:
+        sources.append(a)
+    if word & BOUT:
+        sources.append(b)
+    if word & COUT:
+        sources.append(r.format('c'))
+    if word & DOUT:
+        sources.append(r.format('d'))
+    if word & SOUT:
+        sources.append(f'(({a} - {b}) & 0xff)' if word & SNEG else f'(({a} + {b}) & 0xff)')
+    return ' | '.join(sources) if sources else '0'
+
+
+def statements(word, r):
+    # Python statements for one microstep, reading the bus first and then latching on the clock edge.
+    lines = []
+    if word & BUS_IN:
+        lines.append(f'bus = {bus_source(word, r)}')
+    if word & FLIN:
+        a, b = r.format('a'), r.format('b')
+        s = f'{a} + ({b} ^ 0xff) + 1' if word & SNEG else f'{a} + {b}'
+        lines.append(f's = {s}')
+        lines.append(f'{r.format("flags")} = (s >> 8) | (((s & 0xff) == 0) << 1)')
+    if word & AIN:
+        lines.append(f'{r.format("a")} = bus & 0xff')
+    if word & BIN:
+        lines.append(f'{r.format("b")} = bus & 0xff')
+    if word & CIN:
+        lines.append(f'{r.format("c")} = bus')
+    if word & DLIN and word & DHIN:
+        lines.append(f'{r.format("d")} = bus')
+    elif word & DLIN:
+        lines.append(f'{r.format("d")} = {r.format("d")} & 0xff00 | bus & 0xff')
+    elif word & DHIN:
+        lines.append(f'{r.format("d")} = (bus & 0xff) << 8 | {r.format("d")} & 0xff')
+    if word & OIN:
+        # The output register latches from DL, which OUT loads from A the step before
+        lines.append(f'{r.format("o")} = {r.format("d")} & 0xff')
+        lines.append(f'{r.format("outputs")}.append({r.format("o")})')
+    if word & ILIN:
+        lines.append(f'{r.format("il")} = bus & 0xff')
+    if word & IHIN:
+        lines.append(f'{r.format("ir")} = bus & 0xff')
+    if word & MIN:
+        lines.append(f'{r.format("memory")}[{r.format("mar")}] = bus & 0xff')
+    if word & MAIN:
+        lines.append(f'{r.format("mar")} = bus & 0x7fff')
+    if word & PCLD and word & SGIN:
+        lines.append(f'{r.format("pc")} = bus & 0xff')
+        lines.append(f'{r.format("seg")} = bus >> 8 & 0xff')
+    elif word & PCLD:
+        lines.append(f'{r.format("pc")} = bus & 0xff')
+    elif word & SGIN:
+        lines.append(f'{r.format("seg")} = bus & 0xff')
+    if word & PCEN:
+        lines.append(f'{r.format("pc")} = ({r.format("pc")} + 1) & 0xff')
+    if word & HALT:
+        lines.append(f'{r.format("halted")} = True')
+    return lines
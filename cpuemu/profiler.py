@@ -0,0 +1,64 @@
+import argparse
+import os
+import time
+
+from cpuemu.cpuemu import Machine
+from cpuemu.symbols import Symbols
+from eeproms import control
+
+
+def profile(m, max_cycles=1000000):
+    # Runs m by microstep, charging every cycle to the address of the instruction it belongs to. Returns
+    # {address: [executions, cycles]}.
+    histogram = {}
+    limit = m.cycles + max_cycles
+    while not m.halted and m.cycles < limit:
+        address = (m.seg << 8 | m.pc) & 0x7fff
+        entry = histogram.get(address)
+        if entry is None:
+            entry = histogram[address] = [0, 0]
+        start = m.cycles
+        m.microstep()
+        while m.step and not m.halted and m.cycles < limit:
+            m.microstep()
+        entry[0] += 1
+        entry[1] += m.cycles - start
+    return histogram
+
+
+def print_histogram(histogram, symbols=None, top=0):
+    total = sum([cycles for _, cycles in histogram.values()]) or 1
+    rows = sorted(histogram.items(), key=lambda h: -h[1][1])
+    print(f'  {"Address":<20}  {"Executions":>10}  {"Cycles":>12}  {"Share":>6}')
+    for address, (executions, cycles) in rows[:top or None]:
+        where = symbols.lookup(address) if symbols is not None and len(symbols) else f'{address:04x}'
+        print(f'  {where:<20}  {executions:>10}  {cycles:>12}  {100 * cycles / total:5.1f}%')
+    print(f'  {"Total":<20}  {sum([e for e, _ in histogram.values()]):>10}  {total:>12}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='8bitcpu Emulator Profiler.')
+    parser.add_argument('--cycles', dest='cycles', default=1000000, type=int)
+    parser.add_argument('--no-early-reset', dest='early_reset', action='store_false')
+    parser.add_argument('--symbols', dest='symbols', default='', type=str)
+    parser.add_argument('--top', dest='top', default=32, type=int)
+    parser.add_argument('file', type=str)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file):
+        raise Exception(f'Cannot Find File {args.file}')
+
+    control.EARLY_RESET = args.early_reset
+    with open(args.file, 'rb') as f:
+        m = Machine(f.read())
+    symbols = Symbols.load(args.symbols) if args.symbols else Symbols.find(args.file)
+
+    start = time.perf_counter()
+    histogram = profile(m, args.cycles)
+    elapsed = time.perf_counter() - start
+
+    print()
+    print_histogram(histogram, symbols, args.top)
+    print()
+    print(f'{m.cycles} Microsteps, {m.instructions} Instructions In {elapsed:.3f}s')
+    print()
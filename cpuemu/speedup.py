@@ -0,0 +1,40 @@
+import argparse
+import glob
+import os
+
+import assembler
+from cpuemu import microcode
+from cpuemu.jit import JitMachine
+
+
+DEFAULT_CYCLES = 100000
+
+
+def speedup(image, max_cycles=DEFAULT_CYCLES):
+    # Runs image with SRST ending each instruction after its last non-empty microstep, then finishes the instruction
+    # in flight. Without SRST every instruction takes all STEPS microsteps, so the same run would have taken
+    # STEPS * instructions cycles.
+    m = JitMachine(image)
+    m.run(max_cycles)
+    while m.step and not m.halted:
+        m.microstep()
+    return m.instructions, m.cycles, microcode.STEPS * m.instructions
+
+
+def run(args):
+    sources = sorted(glob.glob(os.path.join(args.dir, '*.8a')))
+    print()
+    print(f'  {"Program":<20}  {"Instructions":>12}  {"Cycles":>10}  {"At 8 Steps":>10}  {"Speedup":>7}')
+    for source_file in sources:
+        _, _, machine_code, _ = assembler.build(source_file)
+        instructions, cycles, fixed = speedup(machine_code, args.cycles)
+        name = os.path.basename(source_file)
+        print(f'  {name:<20}  {instructions:>12}  {cycles:>10}  {fixed:>10}  {fixed / (cycles or 1):6.2f}x')
+    print()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='8bitcpu Step Counter Reset Speedup.')
+    parser.add_argument('--cycles', dest='cycles', default=DEFAULT_CYCLES, type=int)
+    parser.add_argument('dir', nargs='?', default='programs', type=str)
+    run(parser.parse_args())
@@ -0,0 +1,46 @@
+import bisect
+import os
+
+
+class Symbols(object):
+    # Label table written by the assembler's --symbols, one '<address> <label>' line per label
+
+    def __init__(self, labels=None):
+        self.labels = dict(labels or {})
+        self.addresses = sorted(set(self.labels.values()))
+        self.names = {}
+        for label, address in sorted(self.labels.items()):
+            self.names.setdefault(address, label)
+
+    @staticmethod
+    def load(symbols_file):
+        labels = {}
+        with open(symbols_file, 'r') as f:
+            for l in f:
+                l = l.split()
+                if len(l) == 2:
+                    labels[l[1]] = int(l[0], 16)
+        return Symbols(labels)
+
+    @staticmethod
+    def find(image_file):
+        # The symbols file next to an image, if the assembler wrote one there
+        symbols_file = os.path.splitext(image_file)[0] + '.sym'
+        return Symbols.load(symbols_file) if os.path.exists(symbols_file) else Symbols()
+
+    def __getitem__(self, label):
+        return self.labels[label]
+
+    def __contains__(self, label):
+        return label in self.labels
+
+    def __len__(self):
+        return len(self.labels)
+
+    def lookup(self, address):
+        # 'label' or 'label+offset' for the nearest label at or below address, or the bare address
+        i = bisect.bisect_right(self.addresses, address)
+        if i == 0:
+            return f'{address:04x}'
+        base = self.addresses[i - 1]
+        return self.names[base] if base == address else f'{self.names[base]}+{address - base}'
@@ -1,9 +1,15 @@
 import argparse
-import copy
+import concurrent.futures
+import hashlib
+import inspect
 import itertools
+import json
+import os
 import sys
+import threading
+import zlib
 
-import at28c256
+from eeproms import pages
 
 
 # Control Lines
@@ -32,6 +38,21 @@ MIN   = (2, 4)  # 21, -> M Bus Dir [ M Bus Enable = not Mo and not Mi ]
 MOUT  = (2, 5)  # 22, -> M out enable, not M write enable
 FLIN  = (2, 6)  # 23
 SGIN  = (2, 7)  # 24
+SRST  = (3, 0)  # 25, -> Step Counter Clear [ asynchronous, so the step asserting it takes no clock ]
+
+STEPS = 8
+
+# Boards with SRST wired end each instruction after its last non-empty microstep; without it every instruction runs
+# all STEPS. The images and the emulator (cpuemu.microcode.control_words()) both follow this.
+EARLY_RESET = True
+
+EEPROMS = 4
+IMAGE_SIZE = 4 * 0x100 * STEPS
+PAGE_SIZE = pages.PAGE_SIZE
+
+BUILD_DIR = os.path.join(os.path.expanduser('~'), '.8bitcpu', 'control')
+CACHE_DIR = os.path.join(BUILD_DIR, 'cache')
+CHIPS_PATH = os.path.join(BUILD_DIR, 'chips.json')
 
 
 INSTRUCTIONS = {
@@ -901,48 +922,286 @@ INSTRUCTIONS_ZF = {
 }
 
 
-def run(port, target_eeprom):
-    a = at28c256.AT28C256(port=port)
+def with_reset(uops, early_reset=True):
+    # Pads an instruction's microsteps to STEPS, with early_reset asserting SRST in the step after its last non-empty
+    # one so the next fetch starts straight away instead of idling through the empty steps
+    uops = list(uops[:STEPS]) + [()] * (STEPS - len(uops[:STEPS]))
+    last = max([i for i, u in enumerate(uops) if u] + [-1])
+    if early_reset and last + 1 < STEPS:
+        uops[last + 1] = (SRST,)
+    return tuple(uops)
+
+
+def instructions(flags):
+    # The microsteps of all 256 opcodes under flags [ ZF CF ], with unused opcodes decoding as NOP
+    uops = [INSTRUCTIONS['NOP'][1]] * 0x100
+    for instr, (opcode, instr_uops) in INSTRUCTIONS.items():
+        if flags & 0x1 and instr in INSTRUCTIONS_CF:
+            (opcode, instr_uops) = INSTRUCTIONS_CF[instr]
+        if flags & 0x2 and instr in INSTRUCTIONS_ZF:
+            (opcode, instr_uops) = INSTRUCTIONS_ZF[instr]
+        uops[opcode] = instr_uops
+    return uops
+
+
+def words(early_reset=None):
+    # The full control word (bit eeprom * 8 + line) at every address [ ZF CF | opcode | step ], built a whole
+    # instruction at a time. Instructions that share microsteps share the work. early_reset defaults to EARLY_RESET.
+    early_reset = EARLY_RESET if early_reset is None else early_reset
+    table = [0] * IMAGE_SIZE
+    steps = {}
+    for flags in range(0, 4):
+        for opcode, uops in enumerate(instructions(flags)):
+            key = tuple(uops)
+            if key not in steps:
+                steps[key] = [sum([1 << (eeprom * 8 + line) for eeprom, line in set(u)]) for u in with_reset(uops, early_reset)]
+            address = (flags << 11) | (opcode << 3)
+            table[address:address + STEPS] = steps[key]
+    return table
+
+
+def images(table=None):
+    # One 8KB image per control EEPROM, each holding its own byte of every control word
+    table = table or words()
+    return tuple([bytes([(word >> (eeprom * 8)) & 0xff for word in table]) for eeprom in range(0, EEPROMS)])
+
+
+def lines():
+    # The control line map, name -> (eeprom, line)
+    return {
+        name: value for name, value in globals().items()
+        if name.isupper() and type(value) == tuple and len(value) == 2 and all([type(v) == int for v in value])
+    }
+
+
+def digest():
+    # Everything the images are generated from: the three instruction tables, the control line map, EARLY_RESET and
+    # the code that builds them, so changing any of it retires the cached images and the chip records
+    code = [inspect.getsource(f) for f in (with_reset, instructions, words, images)]
+    source = json.dumps([INSTRUCTIONS, INSTRUCTIONS_CF, INSTRUCTIONS_ZF, lines(), STEPS, EARLY_RESET, code],
+                        sort_keys=True)
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def cached_images(cache_dir=CACHE_DIR):
+    # images(), from cache_dir when it already holds the images for the current digest. Returns (digest, images).
+    key = digest()
+    path = os.path.join(cache_dir, f'{key}.bin')
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) == EEPROMS * IMAGE_SIZE:
+            return key, tuple([data[i:i + IMAGE_SIZE] for i in range(0, len(data), IMAGE_SIZE)])
+
+    built = images()
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(b''.join(built))
+    os.replace(path + '.tmp', path)
+    return key, built
+
+
+def checksum(image):
+    return zlib.crc32(image)
+
+
+class Chips(object):
+    # Per-chip record of the digest and checksum of the image last written and verified, keyed by chip name
+
+    def __init__(self, path=CHIPS_PATH):
+        self.path = path
+        self.chips = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.chips = json.load(f)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.chips, f, indent=2, sort_keys=True)
+        os.replace(self.path + '.tmp', self.path)
 
-    opcodes_used = [ v[0] for v in INSTRUCTIONS.values() ]
-    opcodes_unused = [ v for v in range(0, 0x100) if not v in opcodes_used ]
+    def matches(self, chip, key):
+        return self.chips.get(chip, {}).get('digest') == key
 
-    INSTRUCTIONS.update({
-        f'NOP_{o:02x}' : (o, copy.deepcopy(INSTRUCTIONS['NOP'][1]))
-            for o in opcodes_unused
-    })
+    def update(self, chip, key, image):
+        with self.lock:
+            self.chips[chip] = {'digest': key, 'checksum': checksum(image)}
+            self.save()
 
-    for flag_range in (0,1,2,3):
-        for instr, (opcode, uops) in INSTRUCTIONS.items():
-            print(hex(flag_range), instr, hex(opcode))
 
-            if flag_range in [1, 3] and instr in INSTRUCTIONS_CF:
-                (opcode, uops) = INSTRUCTIONS_CF[instr]
-            if flag_range in [2, 3] and instr in INSTRUCTIONS_ZF:
-                (opcode, uops) = INSTRUCTIONS_ZF[instr]
+def image_path(build_dir, eeprom):
+    return os.path.join(build_dir, f'control{eeprom}.bin')
 
-            for j in range(0, 8):
-                addr = (flag_range << 11) | (opcode << 3) | j
 
-                control_byte = 0
-                for u in uops[j]:
-                    eeprom, control_line = u
-                    if eeprom == target_eeprom:
-                        control_byte |= 1 << control_line
+def read_image(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        image = f.read()
+    if len(image) != IMAGE_SIZE:
+        raise Exception(f'Invalid Control Image {path}')
+    return image
 
-                print(f'{addr:06x}', f'{control_byte:02x}')
-                a.write(addr, control_byte)
+
+def write_image(path, image):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(image)
+
+
+def changed_pages(previous, image):
+    # Start addresses of the PAGE_SIZE pages of image that differ from previous (all of them without one)
+    return pages.differing(previous, image)
+
+
+def build(build_dir=BUILD_DIR):
+    # Writes all four images to build_dir, returning them with the pages each changed since the previous build
+    _, built = cached_images(os.path.join(build_dir, 'cache'))
+    changes = []
+    for eeprom, image in enumerate(built):
+        path = image_path(build_dir, eeprom)
+        changes.append(changed_pages(read_image(path), image))
+        write_image(path, image)
+    return built, changes
+
+
+def programmer(port):
+    # The programmer driver is only needed to write chips, so the tables above import without it
+    import at28c256
+    return at28c256.AT28C256(port=port)
+
+
+def run(port, target_eeprom, build_dir=BUILD_DIR, full=False, chip=None, check=False, chips=None, progress=None,
+        log=print):
+    # Page writes only the pages that differ from what the chip holds, then verifies them by bulk readback. The
+    # .bin for target_eeprom is only replaced once the chip verifies. A chip recorded as already holding the
+    # current digest is left alone, or with check only has its checksum read back. Returns the offsets of any
+    # pages that failed verification. Without a chip name the record is only for the programmer's port, which may
+    # hold a different chip by now, so its checksum is always read back before the chip is skipped.
+    check = check or not chip
+    chip = chip or f'{target_eeprom}@{port}'
+    chips = chips or Chips(os.path.join(build_dir, 'chips.json'))
+    key, built = cached_images(os.path.join(build_dir, 'cache'))
+    path = image_path(build_dir, target_eeprom)
+    image = built[target_eeprom]
+    progress = progress or (lambda i, n: print(f'\r>>>>> Page {i}/{n}', end='' if i < n else '\n'))
+
+    if not full and chips.matches(chip, key):
+        if not check:
+            log(f'>>>>> EEPROM {target_eeprom}: {chip} Up To Date ({key[:12]})')
+            return []
+        a = programmer(port)
+        if checksum(pages.read(a, 0, IMAGE_SIZE)) == checksum(image):
+            log(f'>>>>> EEPROM {target_eeprom}: {chip} Up To Date ({key[:12]}), Checksum Verified')
+            return []
+        log(f'>>>>> EEPROM {target_eeprom}: {chip} Checksum Mismatch, Reprogramming')
+    else:
+        a = programmer(port)
+
+    log(f'>>>>> EEPROM {target_eeprom}: {len(changed_pages(read_image(path), image))}/{IMAGE_SIZE // PAGE_SIZE} '
+        f'Pages Changed Since Last Build')
+    written, failed = pages.program(a, image, full=full, progress=progress)
+    log(f'>>>>> EEPROM {target_eeprom}: {len(written)} Pages Written, {len(failed)} Failed Verification')
+    if not failed:
+        write_image(path, image)
+        chips.update(chip, key, image)
+    return failed
+
+
+def run_all(ports, build_dir=BUILD_DIR, full=False, check=False):
+    # Programs several EEPROMs at once, one thread per programmer, given {eeprom: port}. Progress is shown as one
+    # line across all of them; returns {eeprom: failed page offsets, or the exception that stopped it}.
+    chips = Chips(os.path.join(build_dir, 'chips.json'))
+    cached_images(os.path.join(build_dir, 'cache'))
+    lock = threading.Lock()
+    status = {eeprom: '-' for eeprom in sorted(ports)}
+    messages = []
+
+    def show():
+        print('\r>>>>> ' + '  '.join([f'{eeprom}: {s:>7}' for eeprom, s in status.items()]), end='', flush=True)
+
+    def progress(eeprom, i, n):
+        with lock:
+            status[eeprom] = f'{i}/{n}'
+            show()
+
+    def log(message):
+        with lock:
+            messages.append(message)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(ports) or 1) as executor:
+        futures = {
+            eeprom: executor.submit(
+                run, port, eeprom, build_dir, full, None, check, chips, lambda i, n, e=eeprom: progress(e, i, n), log
+            ) for eeprom, port in ports.items()
+        }
+        results = {}
+        for eeprom, future in futures.items():
+            try:
+                results[eeprom] = future.result()
+            except Exception as e:
+                results[eeprom] = e
+            with lock:
+                status[eeprom] = 'Done' if results[eeprom] == [] else 'Failed'
+                show()
+    print()
+
+    for message in messages:
+        print(message)
+    for eeprom, result in sorted(results.items()):
+        if isinstance(result, Exception):
+            print(f'>>>>> EEPROM {eeprom} ({ports[eeprom]}): Error: {result}')
+        elif result:
+            print(f'>>>>> EEPROM {eeprom} ({ports[eeprom]}): Failed Verification At '
+                  f'{", ".join([f"{offset:04x}" for offset in result])}')
+        else:
+            print(f'>>>>> EEPROM {eeprom} ({ports[eeprom]}): OK')
+    return results
+
+
+def parse_ports(text):
+    # '0=/dev/ttyUSB0,1=/dev/ttyUSB1' -> {0: '/dev/ttyUSB0', 1: '/dev/ttyUSB1'}
+    ports = {}
+    for item in text.split(','):
+        eeprom, _, port = item.partition('=')
+        if not eeprom.strip().isdigit() or not port.strip():
+            raise Exception(f'Invalid EEPROM Port {item}')
+        eeprom = int(eeprom)
+        if eeprom < 0 or eeprom >= EEPROMS or eeprom in ports:
+            raise Exception(f'Invalid Target EEPROM {eeprom}')
+        ports[eeprom] = port.strip()
+    return ports
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Program Control EEPROM.')
-    parser.add_argument('eeprom', type=int)
-    parser.add_argument('port', type=str)
+    parser.add_argument('--build-dir', dest='build_dir', default=BUILD_DIR, type=str)
+    parser.add_argument('--check', dest='check', action='store_true')
+    parser.add_argument('--chip', dest='chip', default=None, type=str)
+    parser.add_argument('--full', dest='full', action='store_true')
+    parser.add_argument('--no-early-reset', dest='early_reset', action='store_false')
+    parser.add_argument('--ports', dest='ports', default='', type=str)
+    parser.add_argument('eeprom', nargs='?', default=None, type=int)
+    parser.add_argument('port', nargs='?', default='', type=str)
     args = parser.parse_args()
+    EARLY_RESET = args.early_reset
+
+    if args.ports:
+        results = run_all(parse_ports(args.ports), args.build_dir, args.full, args.check)
+        sys.exit(0 if all([r == [] for r in results.values()]) else 1)
+
+    if args.eeprom is None:
+        # Build only, reporting what a programming run would now write to each EEPROM
+        for eeprom, changed in enumerate(build(args.build_dir)[1]):
+            print(f'{image_path(args.build_dir, eeprom)}: {len(changed)}/{IMAGE_SIZE // PAGE_SIZE} Pages Changed')
+        sys.exit(0)
 
-    if args.eeprom < 0 or args.eeprom > 3:
+    if args.eeprom < 0 or args.eeprom >= EEPROMS:
         raise Exception('Invalid Target EEPROM')
     elif not args.port:
         raise Exception('Invalid COM PORT')
 
-    run(args.port, args.eeprom)
+    if run(args.port, args.eeprom, args.build_dir, args.full, args.chip, args.check):
+        raise Exception(f'EEPROM {args.eeprom} Verification Failed')
@@ -2,6 +2,8 @@ import argparse
 
 import at28c256
 
+from eeproms import pages
+
 
 digits = [
     0x77, # 0
@@ -17,27 +19,34 @@ digits = [
 ]
 
 
-def run(port):
-    a = at28c256.AT28C256()
+def image():
+    return bytes(
+        [0x8] * 256 +                                           # .
+        [digits[(i // 100) % 10] for i in range(0, 256)] +      # 100s
+        [digits[(i // 10) % 10] for i in range(0, 256)] +       # 10s
+        [digits[i % 10] for i in range(0, 256)]                 # 1s
+    )
+
+
+def run(port, full=False):
+    a = at28c256.AT28C256(port=port)
 
-    for i in range(0, 256):
-        a.write(i, 0x8);                                # .
-        a.write(i + 256, digits[(i // 100) % 10]);      # 100s
-        a.write(i + 512, digits[(i // 10) % 10]);       # 10s
-        a.write(i + 768, digits[i % 10]);               # 1s
+    data = image()
+    written, failed = pages.program(a, data, full=full)
+    print(f'>>>>> {len(written)} Pages Written, {len(failed)} Failed Verification')
 
-    at28c256.hexdump(a.read_range(0, 256), address=0)
-    at28c256.hexdump(a.read_range(256, 256), address=256)
-    at28c256.hexdump(a.read_range(512, 256), address=512)
-    at28c256.hexdump(a.read_range(768, 256), address=768)
+    at28c256.hexdump(pages.read(a, 0, len(data)), address=0)
+    if failed:
+        raise Exception('Verification Failed')
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
+    parser.add_argument('--full', dest='full', action='store_true')
     parser.add_argument('port', type=str)
     args = parser.parse_args()
 
     if not args.port:
         raise Exception('Invalid COM PORT')
 
-    run(args.port)
+    run(args.port, args.full)
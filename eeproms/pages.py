@@ -0,0 +1,43 @@
+PAGE_SIZE = 64
+READ_SIZE = 256
+
+
+def read(a, address, length):
+    # Bulk readback, READ_SIZE bytes per request
+    data = b''
+    for offset in range(0, length, READ_SIZE):
+        data += bytes(a.read_range(address + offset, min(READ_SIZE, length - offset)))
+    return data
+
+
+def differing(current, image):
+    # Offsets of the PAGE_SIZE pages of image that differ from current (all of them without it)
+    return [
+        offset for offset in range(0, len(image), PAGE_SIZE)
+        if current is None or current[offset:offset + PAGE_SIZE] != image[offset:offset + PAGE_SIZE]
+    ]
+
+
+def write_page(a, address, page):
+    # The AT28C256 latches up to PAGE_SIZE bytes within one page and programs them in a single write cycle, so
+    # drivers that expose it take a whole page at once. Others fall back to one write cycle per byte.
+    if hasattr(a, 'write_page'):
+        a.write_page(address, page)
+    else:
+        for i, value in enumerate(page):
+            a.write(address + i, value)
+
+
+def program(a, image, address=0, full=False, progress=None):
+    # Writes the pages of image (placed at address, which must be page aligned) that differ from what the chip
+    # already holds, then reads them back. Returns (offsets written, offsets that failed verification).
+    if address % PAGE_SIZE:
+        raise Exception(f'Unaligned Image Address {address:04x}')
+    offsets = differing(None if full else read(a, address, len(image)), image)
+    for i, offset in enumerate(offsets):
+        write_page(a, address + offset, image[offset:offset + PAGE_SIZE])
+        if progress:
+            progress(i + 1, len(offsets))
+
+    failed = set(differing(read(a, address, len(image)), image)) if offsets else set()
+    return offsets, [offset for offset in offsets if offset in failed]
@@ -6,7 +6,8 @@ setup(name='8bitcpu',
       description='8bitcpu',
       author='Liam Kirton',
       author_email='liam@int3.ws',
-      packages=['bootstrap'],
+      packages=['assembler', 'bootstrap', 'cpuemu', 'eeproms'],
       install_requires=[
           'at28c256',
+          'numpy',
       ])
@@ -0,0 +1,54 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from bootstrap import aio
+from bootstrap.bootstrap import Bootstrap, Shadow
+from bootstrap.standin import StandIn
+
+
+IMAGE = bytes([(i * 7 + 3) & 0xff for i in range(0, 200)])
+
+
+def upload(s, image, shadow=None):
+    b = Bootstrap(s.port, shadow=shadow)
+    try:
+        with b:
+            b.write_range(0, image)
+    finally:
+        b.serial.close()
+
+
+class StandInUploadTest(unittest.TestCase):
+
+    def test_upload(self):
+        with StandIn() as s:
+            upload(s, IMAGE)
+            self.assertEqual(bytes(s.memory[:len(IMAGE)]), IMAGE)
+            self.assertEqual(s.commands[0x05], 4)
+
+    def test_corrupt_blocks_are_resent(self):
+        with StandIn(corrupt=2) as s:
+            upload(s, IMAGE)
+            self.assertEqual(bytes(s.memory[:len(IMAGE)]), IMAGE)
+            self.assertEqual(s.commands[0x05], 6)
+
+    def test_corrupt_checksum_is_resent(self):
+        with StandIn(corrupt_checksum=1) as s, tempfile.TemporaryDirectory() as shadow_dir:
+            shadow = Shadow(s.port, path=os.path.join(shadow_dir, 'shadow.bin'))
+            upload(s, IMAGE, shadow)
+            self.assertEqual(bytes(s.memory[:len(IMAGE)]), IMAGE)
+            self.assertEqual(s.commands[0x05], 5)
+            self.assertEqual(shadow.unacknowledged(0, IMAGE), [])
+
+    def test_async_upload_with_corrupt_blocks(self):
+        with StandIn(corrupt=1) as s:
+            attempts = asyncio.run(aio.upload(s.port, IMAGE, setup_delay=0))
+            self.assertEqual(attempts, 1)
+            self.assertEqual(bytes(s.memory[:len(IMAGE)]), IMAGE)
+            self.assertEqual(s.commands[0x05], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,22 @@
+import unittest
+
+from assembler.assembler import IncrementalAssembler, assemble, link, parse
+
+
+class IncrementalAssemblerTest(unittest.TestCase):
+
+    def test_matches_full_link(self):
+        inc = IncrementalAssembler()
+        for lines in [['start:', 'LD 1 RA', 'loop:', 'OUT', 'JMP loop'],
+                      ['start:', 'LD 2 RA', 'loop:', 'OUT', 'ADD', 'JMP loop'],
+                      ['start:'] + ['NOP'] * 254 + ['JMP end', 'end:'],
+                      ['start:'] + ['NOP'] * 200 + ['JMP end', 'end:']]:
+            self.assertEqual(inc.update(lines), link(assemble(parse(lines))))
+
+    def test_duplicate_label(self):
+        with self.assertRaisesRegex(Exception, 'Duplicate Label'):
+            IncrementalAssembler().update(['a:', 'NOP', 'a:', 'JMP a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+import cpuemu
+from assembler.assembler import assemble, link, parse
+
+
+NOPS = ['NOP'] * 300
+
+
+def run(lines, cycles=200000):
+    m = cpuemu.Machine(link(assemble(parse(lines))))
+    m.run(cycles)
+    return m
+
+
+class LinkSegmentsTest(unittest.TestCase):
+
+    def test_backward_jmp_past_segment_0(self):
+        m = run(['start:', 'LD 0 RA', 'LD 1 RB'] + NOPS + ['far:', 'ADD', 'OUT', 'JMP far'])
+        self.assertEqual(m.outputs[:5], [1, 2, 3, 4, 5])
+
+    def test_backward_jz_past_segment_0(self):
+        m = run(['LD 0 RA', 'LD 0 RB', 'JMP go'] + NOPS +
+                ['target:', 'LD 9 RA', 'OUT', 'HLT', 'go:', 'ADD', 'JZ target', 'HLT'])
+        self.assertTrue(m.halted)
+        self.assertEqual(m.outputs, [9])
+
+    def test_backward_jc_past_segment_0(self):
+        m = run(['LD 0xff RA', 'LD 1 RB', 'JMP go'] + NOPS +
+                ['target:', 'LD 9 RA', 'OUT', 'HLT', 'go:', 'ADD', 'JC target', 'HLT'])
+        self.assertTrue(m.halted)
+        self.assertEqual(m.outputs, [9])
+
+    def test_forward_jmp_past_segment_0(self):
+        m = run(['LD 7 RA', 'JMP far'] + NOPS + ['far:', 'OUT', 'HLT'])
+        self.assertTrue(m.halted)
+        self.assertEqual(m.outputs, [7])
+
+    def test_data_kept_clear_of_code_and_trampolines(self):
+        m = run(['LD 5 RA', 'ST RA *0xfa', 'LD 0 RA', 'LD 0 RB', 'ADD', 'JZ far'] + NOPS +
+                ['HLT', 'far:', 'LD *0xfa RA', 'OUT', 'HLT'])
+        self.assertTrue(m.halted)
+        self.assertEqual(m.outputs, [5])
+
+    def test_data_on_segment_carry(self):
+        with self.assertRaisesRegex(Exception, 'Memory Operand Overlaps Segment Carry ff'):
+            link(assemble(parse(['LD 5 RA', 'ST RA *0xff'] + NOPS + ['LD *0xff RA', 'OUT', 'HLT'])))
+
+    def test_data_at_0xff_in_one_segment(self):
+        m = run(['LD 5 RA', 'ST RA *0xff', 'LD *0xff RA', 'OUT', 'HLT'])
+        self.assertEqual(m.outputs, [5])
+
+    def test_rd_kept_in_one_segment(self):
+        m = run(['LD 0x40 RD', 'LD 7 RA', 'JMP far'] + NOPS[:100] + ['far:', 'ST RA *RD', 'LD *0x40 RA', 'OUT', 'HLT'])
+        self.assertEqual(m.outputs, [7])
+
+    def test_far_jump_refused_when_rd_is_read(self):
+        with self.assertRaisesRegex(Exception, 'Jump To far Needs RD, Which The Program Reads'):
+            link(assemble(parse(['LD 0x40 RD', 'LD 7 RA', 'JMP far'] + NOPS +
+                                ['far:', 'ST RA *RD', 'LD *0x40 RA', 'OUT', 'HLT'])))
+
+
+if __name__ == '__main__':
+    unittest.main()